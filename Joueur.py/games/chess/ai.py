@@ -4,9 +4,23 @@
 from joueur.base_ai import BaseAI
 
 # <<-- Creer-Merge: imports -->> - Code you add between this comment and the end comment will be preserved between Creer re-runs.
-import random
-from games.chess.state import State
-from games.chess.helper import convert_san, board_index
+from games.chess.state import State, zobrist_hash, piece_lists, board_score
+from games.chess.search import Searcher
+from games.chess.smp import ParallelSearcher
+from games.chess.transposition import TranspositionTable
+from games.chess.ponder import Ponderer
+from games.chess.polyglot import Book
+from games.chess.bitbase import Bitbases
+from games.chess.timeman import TimeManager
+from games.chess.stats import Stats
+from games.chess.profiler import Profiler, game_directory
+from games.chess.memory import MemoryMonitor
+from games.chess.bitboard import fen_to_bitboard
+from games.chess.position import fen_to_position
+from games.chess.helper import board_index
+
+# Transposition table size in MB, can be changed with --aiSettings hash=<MB>
+DEFAULT_HASH_MB = 16
 
 # <<-- /Creer-Merge: imports -->>
 
@@ -39,7 +53,48 @@ class AI(BaseAI):
         """This is called once the game starts and your AI knows its player and game. You can initialize your AI here.
         """
         # <<-- Creer-Merge: start -->> - Code you add between this comment and the end comment will be preserved between Creer re-runs.
-        self.board = fenToState(self.game.fen)
+        # Position backend, picked with --aiSettings backend=mailbox|bitboard|mutable
+        self.load_fen = BACKENDS[self.get_setting('backend') or 'mailbox']
+        # Checks the board against every FEN the server sends, --aiSettings debug=1
+        self.debug = self.get_setting('debug') == '1'
+        self.reset_board()
+        hash_mb = int(self.get_setting('hash') or DEFAULT_HASH_MB)
+        # Null-move pruning and late move reductions, switched off with
+        # --aiSettings nullmove=0 or lmr=0
+        null_move = self.get_setting('nullmove') != '0'
+        lmr = self.get_setting('lmr') != '0'
+        # Endgame bitbases built by games.chess.make_bitbases, --aiSettings bitbases=<directory>
+        bitbases = Bitbases(self.get_setting('bitbases')) if self.get_setting('bitbases') else None
+        # Number of processes to search with, --aiSettings threads=<n>
+        threads = int(self.get_setting('threads') or 1)
+        if threads > 1:
+            self.searcher = ParallelSearcher(threads, hash_mb, null_move=null_move, lmr=lmr, bitbases=bitbases)
+        else:
+            self.searcher = Searcher(TranspositionTable(hash_mb), null_move=null_move, lmr=lmr, bitbases=bitbases)
+        # Polyglot opening book, --aiSettings book=<path to .bin>, and how a
+        # move is picked from it, bookmode=weighted|best
+        self.book = Book(self.get_setting('book')) if self.get_setting('book') else None
+        self.book_mode = self.get_setting('bookmode') or 'weighted'
+        # Splits up the clock, --aiSettings increment=<seconds> if the increment
+        # shouldn't be measured
+        increment = self.get_setting('increment')
+        self.timer = TimeManager(float(increment) if increment else None)
+        # Search on the opponent's time, switched on with --aiSettings ponder=1
+        self.ponderer = Ponderer(self.searcher) if self.get_setting('ponder') == '1' else None
+        # Counters and phase timers of every search, --aiSettings stats=1, and
+        # the file their totals go to at the end, statsfile=<path>
+        self.stats = None
+        if self.get_setting('stats') == '1':
+            self.stats = Stats()
+            self.stats.attach(self.searcher, type(self.board))
+        # Sampling profiler of make_move, --aiSettings profile=1, writing
+        # flamegraph stacks under profiledir=<directory>
+        self.profiler = None
+        if self.get_setting('profile') == '1':
+            directory = game_directory(self.get_setting('profiledir') or 'profiles', self.player.color)
+            self.profiler = Profiler(directory, root=AI.make_move.__code__)
+        # Allocation and resident memory report of every move, --aiSettings memory=1
+        self.memory = MemoryMonitor() if self.get_setting('memory') == '1' else None
         # <<-- /Creer-Merge: start -->>
 
     def game_updated(self) -> None:
@@ -47,6 +102,13 @@ class AI(BaseAI):
         """
         # <<-- Creer-Merge: game-updated -->> - Code you add between this comment and the end comment will be preserved between Creer re-runs.
         self.update_board()
+        if self.stats:
+            self.stats.game_updated(self.game.history)
+        if self.ponderer:
+            hit = self.ponderer.check(self.game.history)
+            if hit is not None:
+                print('Ponder {} on {} (depth {})'.format(
+                    'hit' if hit else 'miss', self.ponderer.expected, self.searcher.depth))
         # <<-- /Creer-Merge: game-updated -->>
 
     def end(self, won: bool, reason: str) -> None:
@@ -57,7 +119,20 @@ class AI(BaseAI):
             reason (str): The human readable string explaining why your AI won or lost.
         """
         # <<-- Creer-Merge: end -->> - Code you add between this comment and the end comment will be preserved between Creer re-runs.
-        # replace with your end logic
+        if self.ponderer:
+            self.ponderer.stop()
+        self.searcher.close()
+        if self.searcher.bitbases:
+            self.searcher.bitbases.close()
+        if self.book:
+            self.book.close()
+        if self.stats:
+            self.stats.detach(self.searcher)
+            self.stats.write(self.get_setting('statsfile') or 'stats.json')
+        if self.profiler:
+            self.profiler.close()
+        if self.memory:
+            self.memory.close()
         # <<-- /Creer-Merge: end -->>
 
     def make_move(self) -> str:
@@ -68,51 +143,131 @@ class AI(BaseAI):
         """
         # <<-- Creer-Merge: makeMove -->> - Code you add between this comment and the end comment will be preserved between Creer re-runs.
         
-        # A list that stores all the valid moves for a given state
-        validMoveList = [] 
-
-        # Loops through all the probable valid moves generated by generate_moves function
-        for move in self.board.generate_moves(): 
-            # piece index is the initial index of a piece on the board
-            # move_index is the final index of a piece on the board
-            (piece_index, move_index) = (move)  
-            
-            # Changing the piece and move indices accordingly if the current player is black
-            if self.player.color == "black":
-                piece_index = 119 - piece_index
-                move_index = 119 - move_index
-            
-            # Converting the board moves to Standard Algebraic Notation
-            initial = convert_san(piece_index).file + str(convert_san(piece_index).rank)
-            final = convert_san(move_index).file + str(convert_san(move_index).rank)
-            totalMove = initial + final
-
-            # Computing the next state of the board with each possible move
-            next_board = self.board.move(move)
-
-            # Add move to the validMoveList only if the move doesn't put king in a check
-            if not next_board.check_check():
-                validMoveList.append(totalMove)
-            
-        # Chooses a random move from the validMoveList
-        randomMove = random.choice(validMoveList)
+        if self.profiler:
+            self.profiler.start()
+        # Budget the time of this move from our clock
+        self.timer.start(self.player.time_remaining / 1e9, len(self.game.history) // 2)
+
+        # The ponder search has to be off the searcher and the CPU before this
+        # move is searched or taken from the book
+        if self.ponderer:
+            self.ponderer.stop()
+
+        # Play from the opening book while it knows the position
+        if self.book:
+            legal = set(self.board.to_uci(move, self.player.color) for move in self.board.generate_legal_moves())
+            book_move = self.book.move(self.game.fen, self.book_mode, legal)
+            if book_move:
+                print('Book move: {}\n'.format(book_move))
+                # a ponder result is only good for this position
+                if self.ponderer:
+                    self.ponderer.take_result()
+                self.timer.stop()
+                self.stop_profiler()
+                return book_move
+
+        if self.stats:
+            self.stats.start_move()
+        if self.memory:
+            self.memory.start_move()
+
+        # After a ponder hit the search carries on from where the ponder search
+        # got to, and if that is already as deep as this move's budget would
+        # get, its move is played at once
+        resume = self.ponderer.take_result() if self.ponderer else None
+        if resume and resume[2] not in list(self.board.generate_legal_moves()):
+            resume = None
+        if resume and self.timer.enough(resume[3]):
+            best_move = resume[2]
+            print('Ponder hit: playing the pondered move of depth {}'.format(resume[0]))
+        else:
+            if resume:
+                print('Ponder hit: resumed at depth {}'.format(resume[0] + 1))
+            # Search the current state with iterative deepening alpha-beta, until the
+            # time manager stops it or the hard budget runs out
+            best_move = self.searcher.search(self.board, self.timer.hard - self.timer.elapsed(), timer=self.timer,
+                                             history=self.hashes, resume=resume and resume[:3])
+        bestMove = self.board.to_uci(best_move, self.player.color)
+
         print('Game State: \n')
         currentState = print_from_fen(self.game.fen, self.player.color)
         print(currentState)
-        print("Valid moves for the piece: \n")
-        validMoves = set()
-        for i in validMoveList:
-            if i[0:2] == randomMove[0:2]:
-                validMoves.add(i)
-        print(validMoves, "\n")
-        return randomMove
+        print("Best move: {} (depth {}, score {}, {} nodes, {} in quiescence, {:.0%} first move cutoffs, "
+              "{:.2f}s of {:.2f}s/{:.2f}s)\n".format(
+                  bestMove, self.searcher.depth, self.searcher.score, self.searcher.nodes, self.searcher.qnodes,
+                  self.searcher.ordering.first_move_cutoff_rate(), self.timer.elapsed(), self.timer.soft,
+                  self.timer.hard))
+        if self.stats:
+            print(self.stats.end_move(self.searcher))
+        if self.memory:
+            print('\n'.join(self.memory.end_move(self.searcher.nodes, self.searcher.tt, self.book,
+                                                 self.searcher.bitbases)))
+
+        # Think about our next move while the opponent thinks about theirs
+        if self.ponderer:
+            self.ponderer.start(self.load_fen(self.game.fen), best_move, self.player.color, len(self.game.history),
+                                self.hashes)
+        if self.stats:
+            self.stats.move_sent(len(self.game.history) + 1)
+        self.timer.stop()
+        self.stop_profiler()
+        return bestMove
         # <<-- /Creer-Merge: makeMove -->>
 
     # <<-- Creer-Merge: functions -->> - Code you add between this comment and the end comment will be preserved between Creer re-runs.
     
-    # Updates the current board state by converting current FEN to State object
-    def update_board(self): 
-        self.board = fenToState(self.game.fen)
+    # Stops sampling at the end of make_move and says where the stacks went
+    def stop_profiler(self):
+        if self.profiler:
+            samples, path = self.profiler.stop()
+            print('Profile: {} samples in {}'.format(samples, path))
+
+    # Brings the board up to date with the game. The moves added to the
+    # history since the last update are played on our own board, so a delta
+    # that doesn't move anything costs nothing and the board keeps its hash
+    # keys and the hashes of the positions played. The FEN is only parsed
+    # again when the history doesn't carry on from the moves we know.
+    def update_board(self):
+        history = self.game.history
+        known = len(self.history)
+        if len(history) < known or list(history[:known]) != self.history:
+            self.reset_board()
+            return
+        for uci in history[known:]:
+            move = self.find_move(uci)
+            if move is None:
+                print('Board sync: {} is not legal here, reloading the FEN'.format(uci))
+                self.reset_board()
+                return
+            self.board = self.board.move(move)
+            self.board_color = 'black' if self.board_color == 'white' else 'white'
+            self.history.append(uci)
+            self.hashes.append(self.board.hash)
+        if self.debug and known < len(history):
+            ours = fen_placement(self.board.piece_squares(), self.board_color)
+            theirs = ' '.join(self.game.fen.split()[:2])
+            if ours != theirs:
+                print('Board sync: {} after {} but the server has {}, reloading the FEN'.format(
+                    ours, ' '.join(history[known:]), theirs))
+                self.reset_board()
+
+    # Loads the board from the game's FEN and starts following the history
+    # from there. hashes lists the positions played since, which the search
+    # scores as draws when it gets back to one of them.
+    def reset_board(self):
+        self.board = self.load_fen(self.game.fen)
+        self.board_color = 'white' if self.game.fen.split()[1] == 'w' else 'black'
+        self.history = list(self.game.history)
+        self.hashes = [self.board.hash]
+
+    # This function returns the legal move of the board with the given UCI
+    # string, or None
+    def find_move(self, uci):
+        uci = uci.lower()
+        for move in self.board.generate_legal_moves():
+            if self.board.to_uci(move, self.board_color) == uci:
+                return move
+        return None
 
 # This function returns a table like formatted string by parsing the given fen string 
 def print_from_fen(fen, us):
@@ -147,6 +302,23 @@ def print_from_fen(fen, us):
     return ''.join(strings)
 
 
+# This function returns the board and side to move fields of a FEN from the
+# piece_squares() of a position, which are seen from the side to move
+def fen_placement(piece_squares, color):
+    squares = ['.'] * 64
+    for piece, square in piece_squares:
+        if color == 'black':
+            piece, square = piece.swapcase(), 63 - square
+        squares[square] = piece
+    rows = []
+    for rank in range(8):
+        row = ''.join(squares[rank * 8:rank * 8 + 8])
+        for empty in range(8, 0, -1):
+            row = row.replace('.' * empty, str(empty))
+        rows.append(row)
+    return '{} {}'.format('/'.join(rows), color[0])
+
+
 # This function returns a state object by parsing the given fen string
 def fenToState(fen_string):
     # generate a State object from a FEN string
@@ -166,8 +338,10 @@ def fenToState(fen_string):
 
     wc = (False, False)
     bc = (False, False)
-    if 'K' in castling: wc = (True, wc[1])
-    if 'Q' in castling: wc = (wc[0], True)
+    # wc[0] is the A1 (queen side) rook, wc[1] the H1 (king side) rook. Black's
+    # rights are seen from the rotated board, so bc[0] is black's king side.
+    if 'Q' in castling: wc = (True, wc[1])
+    if 'K' in castling: wc = (wc[0], True)
     if 'k' in castling: bc = (True, bc[1])
     if 'q' in castling: bc = (bc[0], True)
 
@@ -176,9 +350,20 @@ def fenToState(fen_string):
     else:
         enpassant = 0
 
-    # Position(board score wc bc ep kp depth)
+    # Position(board score wc bc ep kp depth captured hash pieces)
+    state = State(board_out, board_score(board_out), wc, bc, enpassant, 0, 0, None,
+                  zobrist_hash(board_out, wc, bc, enpassant), piece_lists(board_out))
     if player == 'w':
-        return State(board_out, 0, wc, bc, enpassant, 0, 0, None)
+        return state
     else:
-        return State(board_out, 0, wc, bc, enpassant, 0, 0, None).rotate()
+        return state.rotate()
+
+
+# FEN loaders of the position backends the search can run on
+BACKENDS = {
+    'mailbox': fenToState,
+    'bitboard': fen_to_bitboard,
+    'mutable': fen_to_position,
+}
     # <<-- /Creer-Merge: functions -->>
+
@@ -0,0 +1,299 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+from games.chess.transposition import TranspositionTable
+
+"""
+Benchmarks for the position backends and the search. The movegen benchmark
+runs move generation over a fixed set of positions again and again for about
+the given number of seconds and reports how many moves per second it
+produced, so a change to a move generator can be measured on its own, without
+the search around it. The search benchmark searches the same positions to a
+fixed depth with the selective search features switched on and off.
+
+The bench command is the one to run on every change. It searches the 50
+BENCH_FENS to a fixed depth or node limit, each with a new searcher and table,
+so nothing carries over from one position to the next and the search is the
+same on every run: the total node count is a signature that only changes when
+the search does something different, while nodes per second measures speed.
+The signature of every backend is kept in SIGNATURES and checked when the
+bench runs with its defaults.
+It also reports the time to reach each depth and the table's hit rate, and
+can write all of it as JSON.
+
+    python -m games.chess.bench [bench] [--depth D | --nodes N] [--backend B] [--json PATH]
+    python -m games.chess.bench movegen [seconds] [fens...]
+    python -m games.chess.bench search [depth] [fens...]
+"""
+
+# Depth of the bench command, about half a minute for all positions on one core
+BENCH_DEPTH = 5
+# Transposition table size of the bench in MB, the replacements in a smaller
+# one change the node count
+BENCH_HASH_MB = 16
+
+# Total nodes of the bench of each backend at BENCH_DEPTH with a table of
+# BENCH_HASH_MB. A change that makes the search visit other nodes has to
+# update them, test_bench checks them.
+SIGNATURES = {
+    'mailbox': 557848,
+    'bitboard': 565638,
+    'mutable': 566768,
+}
+
+# Positions the benchmarks run on: the start position, Kiwipete, a rook
+# endgame and two middlegames from the perft suite
+FENS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+    'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+]
+
+# Positions of the search benchmark: openings, middlegames full of tactics,
+# pawn and piece endgames, promotions and one stalemate
+BENCH_FENS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 10',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 11',
+    '4rrk1/pp1n3p/3q2pQ/2p1pb2/2PP4/2P3N1/P2B2PP/4RRK1 b - - 7 19',
+    'rq3rk1/ppp2ppp/1bnpb3/3N2B1/3NP3/7P/PPPQ1PP1/2KR3R w - - 7 14',
+    'r1bq1r1k/1pp1n1pp/1p1p4/4p2Q/4Pp2/1BNP4/PPP2PPP/3R1RK1 w - - 2 14',
+    'r3r1k1/2p2ppp/p1p1bn2/8/1q2P3/2NPQN2/PPP3PP/R4RK1 b - - 2 15',
+    'r1bbk1nr/pp3p1p/2n5/1N4p1/2Np1B2/8/PPP2PPP/2KR1B1R w kq - 0 13',
+    'r1bq1rk1/ppp1nppp/4n3/3p3Q/3P4/1BP1B3/PP1N2PP/R4RK1 w - - 1 16',
+    '4r1k1/r1q2ppp/ppp2n2/4P3/5Rb1/1N1BQ3/PPP3PP/R5K1 w - - 1 17',
+    '2rqkb1r/ppp2p2/2npb1p1/1N1Nn2p/2P1PP2/8/PP2B1PP/R1BQK2R b KQ - 0 11',
+    'r1bq1r1k/b1p1npp1/p2p3p/1p6/3PP3/1B2NN2/PP3PPP/R2Q1RK1 w - - 1 16',
+    '3r1rk1/p5pp/bpp1pp2/8/q1PP1P2/b3P3/P2NQRPP/1R2B1K1 b - - 6 22',
+    'r1q2rk1/2p1bppp/2Pp4/p6b/Q1PNp3/4B3/PP1R1PPP/2K4R w - - 2 18',
+    '4k2r/1pb2ppp/1p2p3/1R1p4/3P4/2r1PN2/P4PPP/1R4K1 b - - 3 22',
+    '3q2k1/pb3p1p/4pbp1/2r5/PpN2N2/1P2P2P/5PP1/Q2R2K1 b - - 4 26',
+    '6k1/6p1/6Pp/ppp5/3pn2P/1P3K2/1PP2P2/8 b - - 3 54',
+    '3b4/5kp1/1p1p1p1p/pP1PpP1P/P1P1P3/3KN3/8/8 w - - 0 1',
+    '2K5/p7/7P/5pR1/8/5k2/r7/8 w - - 0 1',
+    '8/6pk/1p6/8/PP3p1p/5P2/4KP1q/3Q4 w - - 0 1',
+    '7k/3p2pp/4q3/8/4Q3/5Kp1/P6b/8 w - - 0 1',
+    '8/2p5/8/2kPKp1p/2p4P/2P5/3P4/8 w - - 0 1',
+    '8/1p3pp1/7p/5P1P/2k3P1/8/2K2P2/8 w - - 0 1',
+    '8/pp2r1k1/2p1p3/3pP2p/1P1P1P1P/P5KR/8/8 w - - 0 1',
+    '8/3p4/p1bk3p/Pp6/1Kp1PpPp/2P2P1P/2P5/5B2 b - - 0 1',
+    '5k2/7R/4P2p/5K2/p1r2P1p/8/8/8 b - - 0 1',
+    '6k1/6p1/P6p/r1N5/5p2/7P/1b3PP1/4R1K1 w - - 0 1',
+    '1r3k2/4q3/2Pp3b/3Bp3/2Q2p2/1p1P2P1/1P2KP2/3N4 w - - 0 1',
+    '6k1/4pp1p/3p2p1/P1pPb3/R7/1r2P1PP/3B1P2/6K1 w - - 0 1',
+    '8/3p3B/5p2/5P2/p7/PP5b/k7/6K1 w - - 0 1',
+    '5rk1/q6p/2p3bR/1pPp1rP1/1P1Pp3/P3B1Q1/1K3P2/R7 w - - 93 90',
+    '4rrk1/1p1nq3/p7/2p1P1pp/3P2bp/3Q1Bn1/PPPB4/1K2R1NR w - - 40 21',
+    'r3k2r/3nnpbp/q2pp1p1/p7/Pp1PPPP1/4BNN1/1P5P/R2Q1RK1 w kq - 0 16',
+    '3Qb1k1/1r2ppb1/pN1n2q1/Pp1Pp1Pr/4P2p/4BP2/4B1R1/1R5K b - - 11 40',
+    '4k3/3q1r2/1N2r1b1/3ppN2/2nPP3/1B1R2n1/2R1Q3/3K4 w - - 5 1',
+    '8/8/8/8/5kp1/P7/8/1K1N4 w - - 0 1',
+    '8/8/8/5N2/8/p7/8/2NK3k w - - 0 1',
+    '8/3k4/8/8/8/4B3/4KB2/2B5 w - - 0 1',
+    '8/8/1P6/5pr1/8/4R3/7k/2K5 w - - 0 1',
+    '8/2p4P/8/kr6/6R1/8/8/1K6 w - - 0 1',
+    '8/8/3P3k/8/1p6/8/1P6/1K3n2 b - - 0 1',
+    '8/R7/2q5/8/6k1/8/1P5p/K6R w - - 0 124',
+    '6k1/3b3r/1p1p4/p1n2p2/1PPNpP1q/P3Q1p1/1R1RB1P1/5K2 b - - 0 1',
+    'r2r1n2/pp2bk2/2p1p2p/3q4/3PN1QP/2P3R1/P4PP1/5RK1 w - - 0 1',
+    'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+    'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+    '8/8/4k3/8/8/3QK3/8/8 w - - 0 1',
+    '8/5k2/8/8/8/8/1R6/4K3 w - - 0 1',
+    '8/8/8/8/8/6k1/6p1/6K1 w - - 0 1',
+]
+
+# This function returns the (name, fen loader) pairs of every backend
+def backends():
+    from games.chess.ai import BACKENDS
+    return sorted(BACKENDS.items())
+
+
+# This function calls generate(state) for every state until seconds have
+# passed, and returns the number of moves generated per second
+def moves_per_second(states, generate, seconds):
+    moves = 0
+    rounds = 0
+    start = time.perf_counter()
+    while True:
+        for state in states:
+            moves += len(list(generate(state)))
+        rounds += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return moves / elapsed
+
+
+# Measures pseudo-legal and legal move generation of every backend
+def bench_movegen(fens=FENS, seconds=1.0):
+    results = {}
+    for name, load in backends():
+        states = [load(fen) for fen in fens]
+        results[name] = {
+            'pseudo': moves_per_second(states, lambda state: state.generate_moves(), seconds),
+            'legal': moves_per_second(states, lambda state: state.generate_legal_moves(), seconds),
+        }
+        print('{:<10} pseudo {:>10.0f} moves/s   legal {:>10.0f} moves/s'.format(
+            name, results[name]['pseudo'], results[name]['legal']))
+    return results
+
+
+# Runs a fixed depth search on every position with null-move pruning and late
+# move reductions switched on and off, and reports the nodes, time and
+# effective branching factor (the geometric mean over the positions) of each
+def bench_search(fens=FENS, depth=5, backend='mailbox'):
+    from games.chess.ai import BACKENDS
+    from games.chess.search import Searcher
+    load = BACKENDS[backend]
+    results = {}
+    for null_move, lmr in ((False, False), (True, False), (False, True), (True, True)):
+        nodes, factors = 0, []
+        start = time.perf_counter()
+        for fen in fens:
+            searcher = Searcher(null_move=null_move, lmr=lmr)
+            searcher.search(load(fen), float('inf'), depth)
+            nodes += searcher.nodes
+            # a search that stops early on a mate has no branching factor
+            if searcher.branching_factor():
+                factors.append(searcher.branching_factor())
+        elapsed = time.perf_counter() - start
+        ebf = 1.0
+        for factor in factors:
+            ebf *= factor ** (1.0 / len(factors))
+        name = 'nullmove={} lmr={}'.format(int(null_move), int(lmr))
+        results[name] = {'nodes': nodes, 'seconds': elapsed, 'ebf': ebf}
+        print('{:<20} {:>9} nodes {:>7.2f}s  ebf {:.2f}'.format(
+            name, nodes, elapsed, results[name]['ebf']))
+    return results
+
+
+# A transposition table that counts its probes and how many of them found
+# the position. Only the bench uses it, so the search doesn't pay for the
+# counting when it plays.
+class CountingTable(TranspositionTable):
+
+    def __init__(self, size_mb=16):
+        TranspositionTable.__init__(self, size_mb)
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key):
+        self.probes += 1
+        data = TranspositionTable.probe(self, key)
+        if data:
+            self.hits += 1
+        return data
+
+
+# Searches every position to depth, or for max_nodes nodes each if given, and
+# returns the results as a dict ready for JSON. Prints one line per position
+# and the totals.
+def bench(fens=BENCH_FENS, depth=BENCH_DEPTH, max_nodes=None, backend='mailbox', hash_mb=BENCH_HASH_MB):
+    from games.chess.ai import BACKENDS
+    from games.chess.search import Searcher, MAX_DEPTH
+    load = BACKENDS[backend]
+    if max_nodes:
+        depth = MAX_DEPTH
+    positions = []
+    for n, fen in enumerate(fens):
+        tt = CountingTable(hash_mb)
+        searcher = Searcher(tt)
+        state = load(fen)
+        color = 'white' if fen.split()[1] == 'w' else 'black'
+        start = time.perf_counter()
+        best_move = searcher.search(state, float('inf'), depth, max_nodes=max_nodes)
+        elapsed = time.perf_counter() - start
+        positions.append({
+            'fen': fen,
+            'move': state.to_uci(best_move, color) if best_move else None,
+            'score': searcher.score,
+            'depth': searcher.depth,
+            'nodes': searcher.nodes,
+            'qnodes': searcher.qnodes,
+            'seconds': elapsed,
+            'time_to_depth': searcher.iteration_times,
+            'tt_probes': tt.probes,
+            'tt_hits': tt.hits,
+        })
+        print('{:>2} {:<6} depth {:>2} score {:>7} {:>8} nodes {:>6.2f}s'.format(
+            n + 1, positions[-1]['move'] or '-', searcher.depth, searcher.score, searcher.nodes, elapsed))
+
+    nodes = sum(p['nodes'] for p in positions)
+    seconds = sum(p['seconds'] for p in positions)
+    probes = sum(p['tt_probes'] for p in positions)
+    hits = sum(p['tt_hits'] for p in positions)
+    # seconds all positions that got that deep took to finish each depth
+    time_to_depth = {}
+    for p in positions:
+        for d, t in enumerate(p['time_to_depth'], 1):
+            time_to_depth[d] = time_to_depth.get(d, 0.0) + t
+    total = {
+        'nodes': nodes,
+        'qnodes': sum(p['qnodes'] for p in positions),
+        'seconds': seconds,
+        'nps': nodes / seconds if seconds else 0.0,
+        'tt_hit_rate': hits / probes if probes else 0.0,
+        'time_to_depth': [time_to_depth[d] for d in sorted(time_to_depth)],
+    }
+    print('Time to depth: {}'.format(' '.join(
+        '{}:{:.2f}s'.format(d, t) for d, t in enumerate(total['time_to_depth'], 1))))
+    print('TT hit rate:   {:.1%}'.format(total['tt_hit_rate']))
+    print('Total time:    {:.2f}s'.format(seconds))
+    print('Nodes/sec:     {:.0f}'.format(total['nps']))
+    print('Nodes:         {}'.format(nodes))
+    if fens == BENCH_FENS and depth == BENCH_DEPTH and not max_nodes and hash_mb == BENCH_HASH_MB:
+        expected = SIGNATURES.get(backend)
+        print('Signature:     {}'.format('ok' if nodes == expected else
+                                         'expected {}, update SIGNATURES if the search was meant to change'.format(
+                                             expected)))
+    return {
+        'settings': {'depth': None if max_nodes else depth, 'nodes': max_nodes, 'backend': backend,
+                     'hash': hash_mb, 'positions': len(fens)},
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'positions': positions,
+        'total': total,
+    }
+
+
+def main(argv):
+    from games.chess.ai import BACKENDS
+    # the bench command is the default one
+    if not argv or argv[0].startswith('-'):
+        argv = ['bench'] + list(argv)
+    parser = argparse.ArgumentParser(prog='python -m games.chess.bench')
+    commands = parser.add_subparsers(dest='command')
+    run = commands.add_parser('bench', help='search the bench positions')
+    limit = run.add_mutually_exclusive_group()
+    limit.add_argument('--depth', type=int, default=BENCH_DEPTH)
+    limit.add_argument('--nodes', type=int, default=None, help='nodes per position instead of a depth')
+    run.add_argument('--backend', default='mailbox', choices=sorted(BACKENDS))
+    run.add_argument('--hash', type=int, default=BENCH_HASH_MB, help='transposition table size in MB')
+    run.add_argument('--json', default=None, help='file to write the results to')
+    movegen = commands.add_parser('movegen', help='move generation speed of every backend')
+    movegen.add_argument('seconds', type=float, nargs='?', default=1.0)
+    movegen.add_argument('fens', nargs='*')
+    search = commands.add_parser('search', help='selective search features on and off')
+    search.add_argument('depth', type=int, nargs='?', default=5)
+    search.add_argument('fens', nargs='*')
+    args = parser.parse_args(argv)
+
+    if args.command == 'movegen':
+        bench_movegen(args.fens or FENS, args.seconds)
+    elif args.command == 'search':
+        bench_search(args.fens or FENS, args.depth)
+    else:
+        results = bench(BENCH_FENS, args.depth, args.nodes, args.backend, args.hash)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
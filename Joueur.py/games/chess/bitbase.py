@@ -0,0 +1,306 @@
+import mmap
+import multiprocessing
+import os
+from array import array
+
+from games.chess.state import State, SQUARES, board_score, piece_lists
+
+"""
+Endgame bitbases: the win/draw/loss value and the distance to mate of every
+position of an endgame with few men, computed offline by retrograde analysis
+and probed by the search instead of searching those positions.
+
+A table covers one material signature written strong side first, like KQK or
+KRKP. Its positions are seen from the side to move the way a State sees them,
+so a table has two halves: index 0 to 64^n - 1 with the strong side to move
+and 64^n to 2 * 64^n - 1 with the weak side to move. Within a half the index
+is the squares (SQUARE_INDEX numbering) of the strong pieces in signature
+order and then of the weak pieces, as the digits of a base 64 number.
+
+Each table is written as two files: SIGNATURE.wdl with 2 bits per position,
+4 positions to a byte, and SIGNATURE.dtm with the number of plies to mate in
+one byte per position. Values are from the side to move's view.
+
+The generator plays every position's moves with State, so the bitbases agree
+with our own move generator. Expanding the positions is the slow part and is
+split over a process pool, the retrograde pass runs in the main process:
+mated positions are lost in 0, a position with a move to a lost position is
+won in one more ply than the shortest such move, and a position whose every
+move leads to a won position is lost in one more ply than the longest. What
+is left when nothing changes any more is a draw. make_bitbases.py runs it
+from the command line.
+"""
+
+# Values of the .wdl files, for the side to move
+INVALID, DRAW, WIN, LOSS = 0, 1, 2, 3
+
+# Tables built by default. Every 3 man endgame that isn't a trivial draw,
+# strong side first. 4 man tables hold 33 million positions each and take
+# hours to build in Python, but can be given on the command line.
+DEFAULT_SIGNATURES = ['KQK', 'KRK', 'KPK']
+
+# Order of pieces within one side of a signature
+PIECE_ORDER = 'KQRBNP'
+
+
+# This function returns True if the side with these pieces is the one a
+# signature puts first, most valuable pieces first and then most pieces
+def stronger(us, them):
+    # a side that runs out of pieces first compares as the weaker one
+    end = len(PIECE_ORDER)
+    return [PIECE_ORDER.index(p) for p in us] + [end] <= [PIECE_ORDER.index(p) for p in them] + [end]
+
+
+# This function returns True for material no side can mate with, king against
+# king or against king and one minor piece
+def trivial_draw(signature):
+    return signature in ('KK', 'KBK', 'KNK')
+
+
+# This function returns the signature and index of a position given as
+# piece_squares() of a backend
+def encode(piece_squares):
+    us = sorted(((p, sq) for p, sq in piece_squares if p.isupper()), key=lambda e: PIECE_ORDER.index(e[0]))
+    them = sorted(((p.upper(), sq) for p, sq in piece_squares if p.islower()), key=lambda e: PIECE_ORDER.index(e[0]))
+    us_signature = ''.join(p for p, sq in us)
+    them_signature = ''.join(p for p, sq in them)
+    if stronger(us_signature, them_signature):
+        half, strong, weak = 0, us, them
+    else:
+        half, strong, weak = 1, them, us
+    index = half
+    for p, sq in strong + weak:
+        index = index * 64 + sq
+    return ''.join(p for p, sq in strong) + ''.join(p for p, sq in weak), index
+
+
+# This function returns the State of a table index, or None if the squares
+# don't make a position (two pieces on one square or a pawn on a back rank)
+def decode(signature, index):
+    strong, weak = split_signature(signature)
+    men = len(signature)
+    squares = []
+    for _ in range(men):
+        squares.append(index % 64)
+        index //= 64
+    squares.reverse()
+    if len(set(squares)) < men:
+        return None
+    board = list('         \n         \n' + ' ........\n' * 8 + '         \n         \n')
+    for n, (p, sq) in enumerate(zip(strong + weak, squares)):
+        if p == 'P' and not 8 <= sq < 56:
+            return None
+        # the strong side moves in the first half
+        board[SQUARES[sq]] = p if (n < len(strong)) == (index == 0) else p.lower()
+    board = ''.join(board)
+    return State(board, board_score(board), (False, False), (False, False), 0, 0, 0, None, 0, piece_lists(board))
+
+
+# This function splits a signature into its strong and weak side, KRKP into
+# KR and KP
+def split_signature(signature):
+    k = signature.index('K', 1)
+    return signature[:k], signature[k:]
+
+
+# The tables found in a directory, memory mapped so probing reads only the
+# pages it needs
+class Bitbases:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.files = []
+        for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            signature, extension = os.path.splitext(name)
+            if extension != '.wdl':
+                continue
+            wdl = self.map(os.path.join(directory, name))
+            dtm_path = os.path.join(directory, signature + '.dtm')
+            dtm = self.map(dtm_path) if os.path.exists(dtm_path) else None
+            self.tables[signature] = (wdl, dtm)
+        # probing is skipped quickly for positions with more men than this
+        self.max_men = max([len(signature) for signature in self.tables] + [3])
+
+    # Maps a file read only, keeping it open as long as the map
+    def map(self, path):
+        f = open(path, 'rb')
+        self.files.append(f)
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # A process of a parallel search opens the same directory again
+    def __reduce__(self):
+        return Bitbases, (self.directory,)
+
+    def close(self):
+        for wdl, dtm in self.tables.values():
+            wdl.close()
+            if dtm is not None:
+                dtm.close()
+        for f in self.files:
+            f.close()
+        self.tables, self.files = {}, []
+
+    # This function returns the (value, plies to mate) of the position of a
+    # table, or None if no table has it
+    def lookup(self, signature, index):
+        if trivial_draw(signature):
+            return DRAW, 0
+        table = self.tables.get(signature)
+        if table is None:
+            return None
+        wdl, dtm = table
+        value = wdl[index >> 2] >> ((index & 3) << 1) & 3
+        return value, dtm[index] if dtm is not None else 0
+
+    # This function returns the (value, plies to mate) of the position for
+    # the side to move, or None if it isn't covered
+    def probe(self, state):
+        if state.men() > self.max_men:
+            return None
+        return self.lookup(*encode(state.piece_squares()))
+
+
+# Per process state of the generator's pool: the signature being built and the
+# tables built before it, which the positions after captures and promotions
+# are looked up in
+_signature = None
+_bitbases = None
+
+
+def _init_worker(signature, directory):
+    global _signature, _bitbases
+    _signature = signature
+    _bitbases = Bitbases(directory)
+
+
+# This function expands the positions start to stop - 1 of the table being
+# built. It returns their status, their number of legal moves, the moves
+# that stay in the table as offsets into one flat array of child indices, and
+# what the moves that leave the table lead to, which is already known.
+def _expand(bounds):
+    start, stop = bounds
+    # per position: 0 invalid, 1 playable, 2 checkmated, 3 stalemated
+    status = bytearray(stop - start)
+    moves = array('H', [0]) * (stop - start)
+    offsets = array('I', [0])
+    children = array('I')
+    # over the moves that leave the table: fewest plies to a lost position
+    # (255 for none), how many lead to won positions and the most plies of those
+    win_plies = bytearray(b'\xff') * (stop - start)
+    lost = array('H', [0]) * (stop - start)
+    loss_plies = bytearray(stop - start)
+    for k, index in enumerate(range(start, stop)):
+        state = decode(_signature, index)
+        # the side that just moved can't have left its king in check
+        if state is not None and not state.check_check():
+            legal = list(state.generate_legal_moves())
+            status[k] = 1 if legal else 2 if state.in_check() else 3
+            moves[k] = len(legal)
+            for move in legal:
+                child = state.move(move)
+                signature, child_index = encode(child.piece_squares())
+                if signature == _signature:
+                    children.append(child_index)
+                    continue
+                result = _bitbases.lookup(signature, child_index)
+                if result is None:
+                    raise RuntimeError('{} needs the {} table'.format(_signature, signature))
+                value, plies = result
+                if value == LOSS:
+                    win_plies[k] = min(win_plies[k], plies + 1)
+                elif value == WIN:
+                    lost[k] += 1
+                    loss_plies[k] = max(loss_plies[k], plies + 1)
+        offsets.append(len(children))
+    return start, status, moves, offsets, children, win_plies, lost, loss_plies
+
+
+# This function builds the table of a signature into directory, expanding the
+# positions with a pool of the given number of processes
+def generate(signature, directory, processes=None):
+    size = 2 * 64 ** len(signature)
+    chunk = 64 ** (len(signature) - 1)
+    status = bytearray(size)
+    remaining = array('H', [0]) * size
+    win_plies = bytearray(size)
+    loss_plies = bytearray(size)
+    child_start = array('I', [0]) * (size + 1)
+    children = array('I')
+
+    pool = multiprocessing.Pool(processes, _init_worker, (signature, directory))
+    try:
+        for start, s, m, offsets, c, w, lost, l in pool.imap(_expand, [(i, i + chunk) for i in range(0, size, chunk)]):
+            base = len(children)
+            children.extend(c)
+            status[start:start + chunk] = s
+            win_plies[start:start + chunk] = w
+            loss_plies[start:start + chunk] = l
+            for k in range(chunk):
+                remaining[start + k] = m[k] - lost[k]
+                child_start[start + k + 1] = base + offsets[k + 1]
+    finally:
+        pool.close()
+        pool.join()
+
+    # Predecessors of every position, the reverse of the children
+    parent_start = array('I', [0]) * (size + 1)
+    for child in children:
+        parent_start[child + 1] += 1
+    for i in range(size):
+        parent_start[i + 1] += parent_start[i]
+    parents = array('I', [0]) * len(children)
+    fill = array('I', parent_start)
+    for i in range(size):
+        for c in range(child_start[i], child_start[i + 1]):
+            child = children[c]
+            parents[fill[child]] = i
+            fill[child] += 1
+    del children, fill
+
+    # levels[d] holds the (index, value) found to be decided in d plies
+    wdl = bytearray(size)
+    dtm = bytearray(size)
+    levels = [[] for _ in range(256)]
+    for i in range(size):
+        if status[i] == 2:
+            levels[0].append((i, LOSS))
+        elif status[i] == 3:
+            wdl[i] = DRAW
+        elif status[i] == 1:
+            if win_plies[i] != 255:
+                levels[win_plies[i]].append((i, WIN))
+            elif remaining[i] == 0:
+                levels[loss_plies[i]].append((i, LOSS))
+
+    for plies, level in enumerate(levels):
+        for i, value in level:
+            if wdl[i]:
+                continue
+            wdl[i], dtm[i] = value, plies
+            if plies == 255:
+                continue
+            for p in range(parent_start[i], parent_start[i + 1]):
+                parent = parents[p]
+                if wdl[parent]:
+                    continue
+                if value == LOSS:
+                    levels[plies + 1].append((parent, WIN))
+                else:
+                    remaining[parent] -= 1
+                    loss_plies[parent] = max(loss_plies[parent], plies + 1)
+                    if remaining[parent] == 0:
+                        levels[loss_plies[parent]].append((parent, LOSS))
+        levels[plies] = None
+
+    packed = bytearray(size // 4)
+    for i in range(size):
+        if status[i] and not wdl[i]:
+            wdl[i] = DRAW
+        packed[i >> 2] |= wdl[i] << ((i & 3) << 1)
+    with open(os.path.join(directory, signature + '.wdl'), 'wb') as f:
+        f.write(packed)
+    with open(os.path.join(directory, signature + '.dtm'), 'wb') as f:
+        f.write(dtm)
+    return wdl
+
@@ -0,0 +1,719 @@
+from collections import namedtuple
+from games.chess.state import (zobrist, zobrist_ep, zobrist_wc, zobrist_bc,
+                               swap_halves, KING_ZONE_ATTACK, see_value, SQUARE_INDEX, UNDERPROMOTIONS)
+from games.chess.pst import pst, taper, PHASE
+
+"""
+A bitboard backend with the same generate_moves/move/rotate/check_check
+behaviour as the mailbox State. Every piece type of each color is a 64-bit
+integer with bit 0 for a1 and bit 63 for h8, and a 64 byte board with the
+piece letter of every square answers what stands on a square. Knight, king
+and pawn attacks come from tables built at import. Rook and bishop attacks are
+looked up in one dict per square keyed by the masked occupancy of its lines,
+which takes the place of the multiply-and-shift of magic bitboards.
+
+Legal moves are generated with the check and pin masks applied to whole
+target sets, and captures straight from the opponent's pieces, instead of
+filtering the pseudo-legal moves one by one. Python pays for every loop
+iteration and call rather than for the bit operations, so this backend is
+only faster than the mailbox ones where it does fewer of those. With the
+bench command at depth 4 it searches about 1.5 times as many nodes per
+second as State and generates legal moves about 1.5 times as fast, not the
+several times a compiled bitboard engine gains over a mailbox one.
+"""
+
+
+# Order of the piece sets in BitboardState.pieces, white first then black
+PIECES = 'PNBRQKpnbrqk'
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+RANK_1 = 0xFF
+RANK_8 = RANK_1 << 56
+FULL = (1 << 64) - 1
+
+# Castling right bits, same letters as in FEN
+CASTLE_K, CASTLE_Q, CASTLE_k, CASTLE_q = 1, 2, 4, 8
+A1, E1, H1, A8, E8, H8 = 0, 4, 7, 56, 60, 63
+# Rights lost when a piece leaves or lands on these squares
+castle_mask = [0] * 64
+castle_mask[A1], castle_mask[H1], castle_mask[E1] = CASTLE_Q, CASTLE_K, CASTLE_K | CASTLE_Q
+castle_mask[A8], castle_mask[H8], castle_mask[E8] = CASTLE_q, CASTLE_k, CASTLE_k | CASTLE_q
+
+
+# Returns the 10x12 mailbox index used by State for a bitboard square
+def mailbox(sq):
+    return 91 + (sq & 7) - 10 * (sq >> 3)
+
+
+# Zobrist keys for the white to move orientation of State, so a BitboardState
+# hashes to exactly the same key as the State of the same position
+zobrist_bb = [[zobrist[p][mailbox(sq)] for sq in range(64)] for p in PIECES]
+zobrist_ep_bb = [zobrist_ep[mailbox(sq)] for sq in range(64)]
+# Piece-square scores of State the same way, from white's view
+pst_bb = [[pst[p][mailbox(sq)] for sq in range(64)] for p in PIECES]
+zobrist_castle = [0] * 16
+for rights in range(16):
+    h = 0
+    if rights & CASTLE_Q: h ^= zobrist_wc[0]
+    if rights & CASTLE_K: h ^= zobrist_wc[1]
+    if rights & CASTLE_k: h ^= zobrist_bc[0]
+    if rights & CASTLE_q: h ^= zobrist_bc[1]
+    zobrist_castle[rights] = h
+
+
+# This function returns the squares reached from sq by stepping through the
+# given (file, rank) offsets once (sliding=False) or until blocked by occ
+def _walk(sq, steps, occ=0, sliding=False):
+    result = 0
+    for df, dr in steps:
+        f, r = (sq & 7) + df, (sq >> 3) + dr
+        while 0 <= f < 8 and 0 <= r < 8:
+            b = 1 << (r * 8 + f)
+            result |= b
+            if not sliding or occ & b:
+                break
+            f, r = f + df, r + dr
+    return result
+
+
+knight_attacks = [_walk(sq, ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)))
+                  for sq in range(64)]
+king_attacks = [_walk(sq, ((0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)))
+                for sq in range(64)]
+# pawn_attacks[0][sq] are the squares a white pawn on sq attacks, [1] for black
+pawn_attacks = [[_walk(sq, ((-1, 1), (1, 1))) for sq in range(64)],
+                [_walk(sq, ((-1, -1), (1, -1))) for sq in range(64)]]
+
+# The four lines through a square, each as the pair of opposite directions
+LINES = (((1, 0), (-1, 0)), ((0, 1), (0, -1)), ((1, 1), (-1, -1)), ((1, -1), (-1, 1)))
+
+
+# This function builds, for one line, the relevant occupancy mask of each square
+# and a dict from every occupancy subset of that mask to the attacked squares
+def _line_tables(steps):
+    masks, tables = [], []
+    for sq in range(64):
+        # The last square of a ray is attacked whether it is occupied or not
+        mask = 0
+        for df, dr in steps:
+            f, r = (sq & 7) + df, (sq >> 3) + dr
+            while 0 <= f + df < 8 and 0 <= r + dr < 8:
+                mask |= 1 << (r * 8 + f)
+                f, r = f + df, r + dr
+        masks.append(mask)
+        tables.append(dict((sub, _walk(sq, steps, sub, sliding=True)) for sub in _subsets(mask)))
+    return masks, tables
+
+
+# Generates every subset of the bits of mask
+def _subsets(mask):
+    sub = 0
+    while True:
+        yield sub
+        sub = (sub - mask) & mask
+        if sub == 0:
+            break
+
+
+# This function joins the tables of two lines into one dict per square keyed
+# by the occupancy of both, so an attack takes a single lookup
+def _slider_tables(first, second):
+    (mask1, table1), (mask2, table2) = _line_tables(first), _line_tables(second)
+    masks, tables = [], []
+    for sq in range(64):
+        m1, m2, t1, t2 = mask1[sq], mask2[sq], table1[sq], table2[sq]
+        masks.append(m1 | m2)
+        tables.append(dict((sub, t1[sub & m1] | t2[sub & m2]) for sub in _subsets(m1 | m2)))
+    return masks, tables
+
+
+rook_mask, rook_table = _slider_tables(LINES[0], LINES[1])
+bishop_mask, bishop_table = _slider_tables(LINES[2], LINES[3])
+
+
+def rook_attacks(sq, occ):
+    return rook_table[sq][occ & rook_mask[sq]]
+
+
+def bishop_attacks(sq, occ):
+    return bishop_table[sq][occ & bishop_mask[sq]]
+
+
+# between[a][b] holds the squares strictly between a and b when they share a
+# rank, file or diagonal, line[a][b] the whole line through both of them
+between = [[0] * 64 for _ in range(64)]
+line = [[0] * 64 for _ in range(64)]
+for a in range(64):
+    for steps in LINES:
+        full = _walk(a, steps, 0, sliding=True) | (1 << a)
+        for step in steps:
+            ray = _walk(a, (step,), 0, sliding=True)
+            while ray:
+                b = (ray & -ray).bit_length() - 1
+                ray &= ray - 1
+                between[a][b] = _walk(a, (step,), 1 << b, sliding=True) & ~(1 << b)
+                line[a][b] = full
+
+
+# Bytes of the board: '.' for an empty square and the FEN letter of a piece.
+# PIECE_OF[byte] is the index of that piece in PIECES, LETTER[byte] its
+# uppercase letter whatever its color.
+EMPTY = ord('.')
+PIECE_OF = [None] * 128
+LETTER = ['.'] * 128
+for k, p in enumerate(PIECES):
+    PIECE_OF[ord(p)] = k
+    LETTER[ord(p)] = p.upper()
+
+
+# Counts the set bits of a bitboard
+def popcount(b):
+    return bin(b).count('1')
+
+
+# Converts a bitboard square to its name, e.g. 0 -> a1
+def square_name(sq):
+    return 'abcdefgh'[sq & 7] + str((sq >> 3) + 1)
+
+
+class BitboardState(namedtuple('BitboardState', 'pieces board white castling ep captured hash score')):
+
+    # This function returns the uppercase letter of the piece on the square, of
+    # either side, or '.' if it is empty
+    def piece_on(self, square):
+        return LETTER[self.board[square]]
+
+    # This function checks if a move is a pawn reaching the last rank
+    def promotes(self, move):
+        pawns = self.pieces[PAWN if self.white else PAWN + 6]
+        return bool(pawns & (1 << move[0]) and (1 << move[1]) & (RANK_8 | RANK_1))
+
+    # This function checks if a piece of by_side attacks the square. Like on
+    # State, by_side is True for the side to move and False for the opponent.
+    def is_square_attacked(self, square, by_side):
+        occ = 0
+        for b in self.pieces:
+            occ |= b
+        return bool(self.attackers(square, self.white == by_side, occ))
+
+    # This function returns the pieces of the given color that attack sq, with
+    # occ as the occupancy that blocks sliding pieces
+    def attackers(self, sq, by_white, occ):
+        pieces = self.pieces
+        o = 0 if by_white else 6
+        return (knight_attacks[sq] & pieces[o + KNIGHT]
+                | king_attacks[sq] & pieces[o + KING]
+                | pawn_attacks[1 if by_white else 0][sq] & pieces[o + PAWN]
+                | rook_attacks(sq, occ) & (pieces[o + ROOK] | pieces[o + QUEEN])
+                | bishop_attacks(sq, occ) & (pieces[o + BISHOP] | pieces[o + QUEEN]))
+
+    # Generates only the legal moves. Checkers and pinned pieces are found once
+    # from the king square, a pinned piece may only move along its pin line, a
+    # single check must be captured or blocked and in double check only the king
+    # moves. The king never steps onto an attacked square, and castling never
+    # starts in, passes through or lands in check. The check and pin masks are
+    # applied to the targets of a piece, or of all the free pawns at once.
+    def generate_legal_moves(self):
+        pieces, white, ep = self.pieces, self.white, self.ep
+        us, them = (0, 6) if white else (6, 0)
+        king = pieces[us + KING]
+        if not king:
+            return []
+        k = king.bit_length() - 1
+        own = pieces[us] | pieces[us + 1] | pieces[us + 2] | pieces[us + 3] | pieces[us + 4] | pieces[us + 5]
+        opp = pieces[them] | pieces[them + 1] | pieces[them + 2] | pieces[them + 3] | pieces[them + 4] | pieces[them + 5]
+        occ = own | opp
+        not_own = ~own & FULL
+        attackers = self.attackers
+        checkers = attackers(k, not white, occ)
+        moves = []
+
+        # King moves, with the king taken off the board so it can't hide behind itself
+        to = king_attacks[k] & not_own
+        while to:
+            t = to & -to
+            j = t.bit_length() - 1
+            if not attackers(j, not white, occ ^ king):
+                moves.append((k, j))
+            to ^= t
+        if checkers & (checkers - 1):
+            return moves
+
+        if checkers:
+            target = (checkers | between[k][checkers.bit_length() - 1]) & not_own
+        else:
+            target = not_own
+            castling = self.castling
+            for right, empty, safe, step in ((CASTLE_K, 0x60, (5, 6), 2), (CASTLE_Q, 0x0E, (3, 2), -2)):
+                if not white:
+                    right, empty, safe = right << 2, empty << 56, (safe[0] + 56, safe[1] + 56)
+                if (castling & right and not occ & empty
+                        and pieces[us + ROOK] & (1 << (k + 3 if step > 0 else k - 4))
+                        and not attackers(safe[0], not white, occ)
+                        and not attackers(safe[1], not white, occ)):
+                    moves.append((k, k + step))
+
+        # Pinned pieces and the line each one may still move along
+        pinned, pins = 0, {}
+        snipers = ((rook_attacks(k, opp) & (pieces[them + ROOK] | pieces[them + QUEEN]))
+                   | (bishop_attacks(k, opp) & (pieces[them + BISHOP] | pieces[them + QUEEN])))
+        while snipers:
+            s = snipers & -snipers
+            snipers ^= s
+            sq = s.bit_length() - 1
+            b = between[k][sq] & occ
+            if b & own and not b & (b - 1):
+                pinned |= b
+                pins[b.bit_length() - 1] = line[k][sq]
+
+        # Pawns that aren't pinned move as a whole set, each target is then
+        # mapped back to its pawn
+        pawns = pieces[us + PAWN]
+        free = pawns & ~pinned
+        empty = ~occ & FULL
+        if white:
+            single = (free << 8) & empty
+            double = ((single & (RANK_1 << 16)) << 8) & empty
+            left = ((free & ~FILE_A) << 7) & opp
+            right = ((free & ~FILE_H) << 9) & opp
+            offsets = ((single & target, 8), (double & target, 16), (left & target, 7), (right & target, 9))
+        else:
+            single = (free >> 8) & empty
+            double = ((single & (RANK_8 >> 16)) >> 8) & empty
+            left = ((free & ~FILE_A) >> 9) & opp
+            right = ((free & ~FILE_H) >> 7) & opp
+            offsets = ((single & target, -8), (double & target, -16), (left & target, -9), (right & target, -7))
+        for bb, d in offsets:
+            while bb:
+                b = bb & -bb
+                j = b.bit_length() - 1
+                moves.append((j - d, j))
+                # a pawn reaching the last rank may also become a knight, bishop or rook
+                if b & (RANK_8 | RANK_1):
+                    for promotion in UNDERPROMOTIONS:
+                        moves.append((j - d, j, promotion))
+                bb ^= b
+        # A pinned pawn on its own, only along its pin
+        bb = pawns & pinned
+        while bb:
+            b = bb & -bb
+            i = b.bit_length() - 1
+            bb ^= b
+            if white:
+                push = (b << 8) & empty
+                push |= ((push & (RANK_1 << 16)) << 8) & empty
+            else:
+                push = (b >> 8) & empty
+                push |= ((push & (RANK_8 >> 16)) >> 8) & empty
+            to = (push | pawn_attacks[0 if white else 1][i] & opp) & target & pins[i]
+            while to:
+                t = to & -to
+                j = t.bit_length() - 1
+                moves.append((i, j))
+                if t & (RANK_8 | RANK_1):
+                    for promotion in UNDERPROMOTIONS:
+                        moves.append((i, j, promotion))
+                to ^= t
+        if ep >= 0:
+            # en passant can uncover a check along the rank, so it is simply
+            # played and looked at
+            bb = pawn_attacks[1 if white else 0][ep] & pawns
+            while bb:
+                b = bb & -bb
+                i = b.bit_length() - 1
+                bb ^= b
+                if not self.move((i, ep)).check_check():
+                    moves.append((i, ep))
+
+        for piece in (KNIGHT, BISHOP, ROOK, QUEEN):
+            bb = pieces[us + piece]
+            while bb:
+                b = bb & -bb
+                i = b.bit_length() - 1
+                bb ^= b
+                if piece == KNIGHT:
+                    # a pinned knight can't stay on its pin line
+                    if b & pinned:
+                        continue
+                    to = knight_attacks[i] & target
+                elif piece == BISHOP:
+                    to = bishop_table[i][occ & bishop_mask[i]] & target
+                elif piece == ROOK:
+                    to = rook_table[i][occ & rook_mask[i]] & target
+                else:
+                    to = (rook_table[i][occ & rook_mask[i]] | bishop_table[i][occ & bishop_mask[i]]) & target
+                if b & pinned:
+                    to &= pins[i]
+                while to:
+                    t = to & -to
+                    moves.append((i, t.bit_length() - 1))
+                    to ^= t
+        return moves
+
+    # Generates the pseudo-legal captures and promotions, the moves the
+    # quiescence search plays out, straight from the opponent's pieces
+    def generate_captures(self):
+        pieces, white, ep = self.pieces, self.white, self.ep
+        us, them = (0, 6) if white else (6, 0)
+        own = pieces[us] | pieces[us + 1] | pieces[us + 2] | pieces[us + 3] | pieces[us + 4] | pieces[us + 5]
+        opp = pieces[them] | pieces[them + 1] | pieces[them + 2] | pieces[them + 3] | pieces[them + 4] | pieces[them + 5]
+        occ = own | opp
+        moves = []
+
+        # like the other backends only the promotions to a queen
+        pawns = pieces[us + PAWN]
+        targets = opp | (1 << ep if ep >= 0 else 0)
+        if white:
+            push = (pawns << 8) & ~occ & RANK_8
+            left = ((pawns & ~FILE_A) << 7) & targets
+            right = ((pawns & ~FILE_H) << 9) & targets
+            offsets = ((push, 8), (left, 7), (right, 9))
+        else:
+            push = (pawns >> 8) & ~occ & RANK_1
+            left = ((pawns & ~FILE_A) >> 9) & targets
+            right = ((pawns & ~FILE_H) >> 7) & targets
+            offsets = ((push, -8), (left, -9), (right, -7))
+        for bb, d in offsets:
+            while bb:
+                b = bb & -bb
+                j = b.bit_length() - 1
+                moves.append((j - d, j))
+                bb ^= b
+
+        for piece in (KNIGHT, BISHOP, ROOK, QUEEN, KING):
+            bb = pieces[us + piece]
+            while bb:
+                b = bb & -bb
+                i = b.bit_length() - 1
+                bb ^= b
+                if piece == KNIGHT:
+                    to = knight_attacks[i]
+                elif piece == BISHOP:
+                    to = bishop_table[i][occ & bishop_mask[i]]
+                elif piece == ROOK:
+                    to = rook_table[i][occ & rook_mask[i]]
+                elif piece == QUEEN:
+                    to = rook_table[i][occ & rook_mask[i]] | bishop_table[i][occ & bishop_mask[i]]
+                else:
+                    to = king_attacks[i]
+                to &= opp
+                while to:
+                    t = to & -to
+                    moves.append((i, t.bit_length() - 1))
+                    to ^= t
+        return moves
+
+    # This function returns the static exchange evaluation of a capture like
+    # State.see: both sides keep recapturing on the target square with their
+    # least valuable attacker, and taking pieces out of occ uncovers x-rays
+    def see(self, move):
+        i, j = move[0], move[1]
+        pieces = self.pieces
+        occ = 0
+        for b in pieces:
+            occ |= b
+        victim = self.piece_on(j)
+        gain = [see_value[victim] if victim != '.' else 0]
+        piece = self.piece_on(i)
+        occ ^= 1 << i
+        white = not self.white
+        while True:
+            attackers = self.attackers(j, white, occ) & occ
+            if not attackers:
+                break
+            o = 0 if white else 6
+            k = 0
+            while not attackers & pieces[o + k]:
+                k += 1
+            bit = attackers & pieces[o + k]
+            gain.append(see_value[piece] - gain[-1])
+            piece = PIECES[k]
+            occ ^= bit & -bit
+            white = not white
+        for n in range(len(gain) - 1, 0, -1):
+            gain[n - 1] = -max(-gain[n - 1], gain[n])
+        return gain[0]
+
+    # Generates all pseudo-legal moves of the side to move as (from, to) pairs,
+    # with the piece added for underpromotions
+    def generate_moves(self):
+        pieces, white = self.pieces, self.white
+        us, them = (0, 6) if white else (6, 0)
+        own = pieces[us] | pieces[us + 1] | pieces[us + 2] | pieces[us + 3] | pieces[us + 4] | pieces[us + 5]
+        opp = pieces[them] | pieces[them + 1] | pieces[them + 2] | pieces[them + 3] | pieces[them + 4] | pieces[them + 5]
+        occ = own | opp
+        empty = ~occ & FULL
+        moves = []
+
+        # Pawns move as a whole set, each target is then mapped back to its pawn
+        pawns = pieces[us + PAWN]
+        targets = opp | (1 << self.ep if self.ep >= 0 else 0)
+        if white:
+            single = (pawns << 8) & empty
+            double = ((single & (RANK_1 << 16)) << 8) & empty
+            left = ((pawns & ~FILE_A) << 7) & targets
+            right = ((pawns & ~FILE_H) << 9) & targets
+            offsets = ((single, 8), (double, 16), (left, 7), (right, 9))
+        else:
+            single = (pawns >> 8) & empty
+            double = ((single & (RANK_8 >> 16)) >> 8) & empty
+            left = ((pawns & ~FILE_A) >> 9) & targets
+            right = ((pawns & ~FILE_H) >> 7) & targets
+            offsets = ((single, -8), (double, -16), (left, -9), (right, -7))
+        for bb, d in offsets:
+            while bb:
+                b = bb & -bb
+                j = b.bit_length() - 1
+                moves.append((j - d, j))
+                # a pawn reaching the last rank may also become a knight, bishop or rook
+                if b & (RANK_8 | RANK_1):
+                    for promotion in UNDERPROMOTIONS:
+                        moves.append((j - d, j, promotion))
+                bb ^= b
+
+        not_own = ~own & FULL
+        for piece, attacks in ((KNIGHT, None), (BISHOP, bishop_attacks), (ROOK, rook_attacks),
+                               (QUEEN, None), (KING, None)):
+            bb = pieces[us + piece]
+            while bb:
+                b = bb & -bb
+                i = b.bit_length() - 1
+                bb ^= b
+                if piece == KNIGHT:
+                    to = knight_attacks[i]
+                elif piece == KING:
+                    to = king_attacks[i]
+                elif piece == QUEEN:
+                    to = rook_attacks(i, occ) | bishop_attacks(i, occ)
+                else:
+                    to = attacks(i, occ)
+                to &= not_own
+                while to:
+                    t = to & -to
+                    moves.append((i, t.bit_length() - 1))
+                    to ^= t
+
+        # Castling, the squares between king and rook have to be empty
+        castling = self.castling
+        if white:
+            if castling & CASTLE_K and not occ & 0x60 and pieces[us + ROOK] & (1 << H1):
+                moves.append((E1, E1 + 2))
+            if castling & CASTLE_Q and not occ & 0x0E and pieces[us + ROOK] & (1 << A1):
+                moves.append((E1, E1 - 2))
+        else:
+            if castling & CASTLE_k and not occ & (0x60 << 56) and pieces[us + ROOK] & (1 << H8):
+                moves.append((E8, E8 + 2))
+            if castling & CASTLE_q and not occ & (0x0E << 56) and pieces[us + ROOK] & (1 << A8):
+                moves.append((E8, E8 - 2))
+        return moves
+
+    # Passes the turn to the other side, keeping the en passant square like State.rotate
+    def rotate(self):
+        return BitboardState(self.pieces, self.board, not self.white, self.castling, self.ep, self.captured,
+                             swap_halves(self.hash), self.score)
+
+    # This function returns the BitboardState after the move, ready for the other side
+    def move(self, move):
+        i, j = move[0], move[1]
+        pieces = list(self.pieces)
+        white = self.white
+        us, them = (0, 6) if white else (6, 0)
+        # hash in the white to move orientation while we update it
+        h = self.hash if white else swap_halves(self.hash)
+        castling, ep = self.castling, -1
+        h ^= zobrist_castle[castling] ^ (zobrist_ep_bb[self.ep] if self.ep >= 0 else 0)
+        score = self.score
+
+        frm, to = 1 << i, 1 << j
+        board = bytearray(self.board)
+        piece = PIECE_OF[board[i]]
+        captured = '.'
+        if board[j] != EMPTY:
+            victim = PIECE_OF[board[j]]
+            pieces[victim] ^= to
+            h ^= zobrist_bb[victim][j]
+            score -= pst_bb[victim][j]
+            captured = PIECES[victim - them]
+        pieces[piece] ^= frm | to
+        board[j], board[i] = board[i], EMPTY
+        h ^= zobrist_bb[piece][i] ^ zobrist_bb[piece][j]
+        score += pst_bb[piece][j] - pst_bb[piece][i]
+
+        if piece == us + PAWN:
+            if j == self.ep:
+                # en passant, the captured pawn sits behind the target square
+                k = j - 8 if white else j + 8
+                pieces[them + PAWN] ^= 1 << k
+                board[k] = EMPTY
+                h ^= zobrist_bb[them + PAWN][k]
+                score -= pst_bb[them + PAWN][k]
+            elif abs(j - i) == 16:
+                ep = (i + j) // 2
+            elif to & (RANK_8 | RANK_1):
+                # Promote the pawn to Queen unless the move names another piece
+                promoted = us + (PIECES.index(move[2]) if len(move) > 2 else QUEEN)
+                pieces[piece] ^= to
+                pieces[promoted] |= to
+                board[j] = ord(PIECES[promoted])
+                h ^= zobrist_bb[piece][j] ^ zobrist_bb[promoted][j]
+                score += pst_bb[promoted][j] - pst_bb[piece][j]
+        elif piece == us + KING and abs(j - i) == 2:
+            # Castling, bring the rook over to the other side of the king
+            r_from, r_to = (i + 3, i + 1) if j > i else (i - 4, i - 1)
+            pieces[us + ROOK] ^= (1 << r_from) | (1 << r_to)
+            board[r_to], board[r_from] = board[r_from], EMPTY
+            h ^= zobrist_bb[us + ROOK][r_from] ^ zobrist_bb[us + ROOK][r_to]
+            score += pst_bb[us + ROOK][r_to] - pst_bb[us + ROOK][r_from]
+
+        castling &= ~(castle_mask[i] | castle_mask[j])
+        h ^= zobrist_castle[castling] ^ (zobrist_ep_bb[ep] if ep >= 0 else 0)
+        return BitboardState(tuple(pieces), bytes(board), not white, castling, ep, captured,
+                             swap_halves(h) if white else h, score)
+
+    # This function passes the turn without moving, for null-move pruning, and
+    # drops the en passant square like State.null_move
+    def null_move(self):
+        h = self.hash if self.white else swap_halves(self.hash)
+        if self.ep >= 0:
+            h ^= zobrist_ep_bb[self.ep]
+        return BitboardState(self.pieces, self.board, not self.white, self.castling, -1, None,
+                             swap_halves(h) if self.white else h, self.score)
+
+    # This function checks if the side to move has a piece other than pawns and
+    # the king, without which passing the turn is often the best move
+    def has_non_pawn_material(self):
+        pieces = self.pieces
+        us = 0 if self.white else 6
+        return bool(pieces[us + KNIGHT] | pieces[us + BISHOP] | pieces[us + ROOK] | pieces[us + QUEEN])
+
+    # The number of pieces on the board, kings included
+    def men(self):
+        return sum(bin(b).count('1') for b in self.pieces)
+
+    # Every piece on the board as the side to move sees it, see State.piece_squares
+    def piece_squares(self):
+        result = []
+        for k, b in enumerate(self.pieces):
+            p = PIECES[k] if self.white else PIECES[k].swapcase()
+            while b:
+                sq = (b & -b).bit_length() - 1
+                b &= b - 1
+                i = mailbox(sq)
+                result.append((p, SQUARE_INDEX[i if self.white else 119 - i]))
+        return result
+
+    # Nothing to take back after move(), see State.unmove
+    def unmove(self):
+        pass
+
+    # This function checks if the side to move can capture the opponent's king
+    def check_check(self):
+        king = self.pieces[KING + 6 if self.white else KING]
+        return bool(king) and self.is_square_attacked(king.bit_length() - 1, True)
+
+    # This function checks if the side to move is in check
+    def in_check(self):
+        king = self.pieces[KING if self.white else KING + 6]
+        return bool(king) and self.is_square_attacked(king.bit_length() - 1, False)
+
+    # This function returns every square the pieces of the given color
+    # attack, with occ as the occupancy that blocks sliding pieces
+    def attacked_squares(self, by_white, occ):
+        pieces = self.pieces
+        o = 0 if by_white else 6
+        pawns = pieces[o + PAWN]
+        if by_white:
+            result = (((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)) & FULL
+        else:
+            result = ((pawns & ~FILE_A) >> 9) | ((pawns & ~FILE_H) >> 7)
+        for bb, table in ((pieces[o + KNIGHT], knight_attacks), (pieces[o + KING], king_attacks)):
+            while bb:
+                b = bb & -bb
+                result |= table[b.bit_length() - 1]
+                bb ^= b
+        bb = pieces[o + BISHOP] | pieces[o + QUEEN]
+        while bb:
+            b = bb & -bb
+            i = b.bit_length() - 1
+            result |= bishop_table[i][occ & bishop_mask[i]]
+            bb ^= b
+        bb = pieces[o + ROOK] | pieces[o + QUEEN]
+        while bb:
+            b = bb & -bb
+            i = b.bit_length() - 1
+            result |= rook_table[i][occ & rook_mask[i]]
+            bb ^= b
+        return result
+
+    # This function returns the king zone penalty of State.king_safety for
+    # white, from the squares around each king the other side attacks
+    def king_safety(self):
+        pieces = self.pieces
+        occ = 0
+        for b in pieces:
+            occ |= b
+        score = 0
+        for o, sign in ((0, -1), (6, 1)):
+            king = pieces[o + KING]
+            if king:
+                zone = king_attacks[king.bit_length() - 1] & self.attacked_squares(o == 6, occ)
+                score += sign * KING_ZONE_ATTACK * popcount(zone)
+        return score
+
+    # This function scores the position for the side to move like
+    # State.evaluate, from the piece-square score kept up to date by move()
+    def evaluate(self):
+        pieces = self.pieces
+        phase = 0
+        for k in (KNIGHT, BISHOP, ROOK, QUEEN):
+            phase += PHASE[PIECES[k]] * popcount(pieces[k] | pieces[k + 6])
+        if self.white:
+            return taper(self.score, phase) + self.king_safety()
+        return taper(-self.score, phase) - self.king_safety()
+
+    # Converts a move into UCI notation. The color argument is only there to
+    # match State.to_uci, a BitboardState knows its own side.
+    def to_uci(self, move, color=None):
+        i, j = move[0], move[1]
+        pawn = self.pieces[PAWN if self.white else PAWN + 6]
+        promotion = ''
+        if pawn & (1 << i) and (1 << j) & (RANK_8 | RANK_1):
+            promotion = move[2].lower() if len(move) > 2 else 'q'
+        return square_name(i) + square_name(j) + promotion
+
+
+# This function returns a BitboardState by parsing the given fen string
+def fen_to_bitboard(fen_string):
+    board, player, castling, enpassant, halfmove, move = fen_string.split()
+    pieces = [0] * 12
+    squares = bytearray(b'.' * 64)
+    for r, row in enumerate(board.split('/')):
+        f = 0
+        for piece in row:
+            if piece.isdigit():
+                f += int(piece)
+            else:
+                pieces[PIECES.index(piece)] |= 1 << ((7 - r) * 8 + f)
+                squares[(7 - r) * 8 + f] = ord(piece)
+                f += 1
+
+    rights = 0
+    for c, bit in (('K', CASTLE_K), ('Q', CASTLE_Q), ('k', CASTLE_k), ('q', CASTLE_q)):
+        if c in castling:
+            rights |= bit
+    ep = -1
+    if enpassant != '-':
+        ep = (ord(enpassant[0]) - ord('a')) + 8 * (int(enpassant[1]) - 1)
+
+    h = zobrist_castle[rights] ^ (zobrist_ep_bb[ep] if ep >= 0 else 0)
+    score = 0
+    for k, bb in enumerate(pieces):
+        while bb:
+            b = bb & -bb
+            h ^= zobrist_bb[k][b.bit_length() - 1]
+            score += pst_bb[k][b.bit_length() - 1]
+            bb ^= b
+    white = player == 'w'
+    return BitboardState(tuple(pieces), bytes(squares), white, rights, ep, None, h if white else swap_halves(h), score)
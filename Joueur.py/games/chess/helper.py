@@ -23,7 +23,23 @@ def board_file(board_index):
 def board_rank(board_index):
     return 10 - (board_index // 10)
 
+# File and rank of a square
+Square = namedtuple('board', 'file rank')
+
 # Converts the given board index (21 - 98) to Standard Algebraic Notation
 def convert_san(board_index):
-    board = namedtuple('board', 'file rank')
-    return board(board_file(board_index), board_rank(board_index))
\ No newline at end of file
+    return Square(board_file(board_index), board_rank(board_index))
+
+# Converts a move on the given State into UCI notation. The State is always
+# oriented towards the side to move, so black's indices have to be flipped back.
+def move_to_uci(state, move, color):
+    (piece_index, move_index) = move[0], move[1]
+    promotion = ''
+    if state.board[piece_index] == 'P' and A8 <= move_index <= H8:
+        promotion = move[2].lower() if len(move) > 2 else 'q'
+    if color == "black":
+        piece_index = 119 - piece_index
+        move_index = 119 - move_index
+    initial = convert_san(piece_index).file + str(convert_san(piece_index).rank)
+    final = convert_san(move_index).file + str(convert_san(move_index).rank)
+    return initial + final + promotion
@@ -0,0 +1,31 @@
+import os
+import sys
+import time
+
+from games.chess.bitbase import generate, DEFAULT_SIGNATURES, WIN, DRAW, LOSS
+
+"""
+Builds the endgame bitbases of bitbase.py. This is a module of its own so
+that bitbase isn't run as __main__ after the games.chess package has already
+imported it through the AI.
+
+    python -m games.chess.make_bitbases [directory] [signatures...]
+"""
+
+
+def main(argv):
+    directory = argv[0] if argv else 'bitbases'
+    # fewer men first and pawnless first, so the tables a capture or a
+    # promotion leads to are there before they are needed
+    signatures = sorted(argv[1:] or DEFAULT_SIGNATURES, key=lambda s: (len(s), 'P' in s))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for signature in signatures:
+        start = time.perf_counter()
+        wdl = generate(signature, directory)
+        print('{}: {} wins, {} draws, {} losses in {:.0f}s'.format(
+            signature, wdl.count(WIN), wdl.count(DRAW), wdl.count(LOSS), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
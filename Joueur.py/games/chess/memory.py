@@ -0,0 +1,171 @@
+import gc
+import os
+import sys
+import tracemalloc
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+"""
+Memory diagnostics, switched on with --aiSettings memory=1. Every State a
+search visits is a new namedtuple with a new board string, so a search
+allocates all the time, and a cache keyed by positions that never forgets
+any makes the process grow from turn to turn. This mode follows both.
+
+tracemalloc traces every allocation from the start of the game. It keeps
+the blocks that are alive, not a count of all allocations, so a move reports:
+
+- the peak of traced memory during the search above what was traced before
+  it, per node searched: what the positions being searched hold at once;
+- the memory still alive after the search that wasn't before, per node, and
+  the source lines in games/chess that hold most of it;
+- the resident set size of the process, and how much of the transposition
+  table, the opening book and the bitbases it holds. The book and bitbases
+  are memory mapped, so only the pages read are resident.
+
+After every move the memory still traced is compared with the turn before.
+If it grew in each of the last LEAK_TURNS turns by more than LEAK_BYTES in
+all, a warning names the lines that grew the most, which is how a cache that
+keeps every position ever seen shows up.
+
+Tracing costs time, so the search is a lot slower in this mode.
+"""
+
+# Source lines listed in a report
+TOP_LINES = 5
+# Turns in a row traced memory has to grow in, and by how much in all, before
+# a warning
+LEAK_TURNS = 3
+LEAK_BYTES = 256 * 1024
+
+# Only allocations from these files are listed, not the monitor's own
+SOURCES = (tracemalloc.Filter(True, '*' + os.path.join('games', 'chess', '*')),
+           tracemalloc.Filter(False, __file__))
+
+
+# This function returns the resident set size of the process in bytes, from
+# /proc where there is one and else the peak size from getrusage, or None
+def rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# This function returns how many bytes of the files at the given paths are
+# resident in memory through mappings of this process, or None if the system
+# doesn't say. Linux lists every mapping with its resident size in smaps.
+def mapped_rss(paths):
+    paths = set(os.path.realpath(path) for path in paths)
+    if not paths:
+        return 0
+    try:
+        f = open('/proc/self/smaps')
+    except OSError:
+        return None
+    total, counting = 0, False
+    with f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if not fields[0].endswith(':'):
+                # a new mapping: address perms offset device inode [path]
+                counting = len(fields) >= 6 and os.path.realpath(fields[5]) in paths
+            elif fields[0] == 'Rss:' and counting:
+                total += int(fields[1]) * 1024
+    return total
+
+
+# This function formats a number of bytes
+def size(n):
+    if n is None:
+        return '?'
+    for unit in ('B', 'KB', 'MB'):
+        if abs(n) < 1024:
+            return '{:.0f}{}'.format(n, unit) if unit == 'B' else '{:.1f}{}'.format(n, unit)
+        n /= 1024.0
+    return '{:.1f}GB'.format(n)
+
+
+class MemoryMonitor:
+
+    def __init__(self):
+        tracemalloc.start()
+        self.before = None
+        self.before_traced = 0
+        # snapshot and traced memory at the end of the last turn, and how
+        # much the traced memory grew in each turn
+        self.last = None
+        self.last_traced = None
+        self.growth = []
+        self.rss_start = rss()
+
+    # Called before the search of a move
+    def start_move(self):
+        self.before = tracemalloc.take_snapshot().filter_traces(SOURCES)
+        self.before_traced = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9
+            tracemalloc.reset_peak()
+        self.rss_before = rss()
+
+    # Called after the search of a move, returns the report as lines to print
+    def end_move(self, nodes, tt=None, book=None, bitbases=None):
+        peak = tracemalloc.get_traced_memory()[1]
+        # only what is still referenced counts as retained, not garbage that
+        # is waiting for the cycle collector
+        gc.collect()
+        traced = tracemalloc.get_traced_memory()[0]
+        after = tracemalloc.take_snapshot().filter_traces(SOURCES)
+        nodes = max(nodes, 1)
+        rss_now = rss()
+        lines = ['Memory: rss {} ({:+.1f}MB this move), peak {} per node, {} per node retained'.format(
+            size(rss_now), (rss_now - self.rss_before) / (1 << 20) if rss_now and self.rss_before else 0.0,
+            size((peak - self.before_traced) / nodes), size((traced - self.before_traced) / nodes))]
+        lines.append('  ' + self.resident(tt, book, bitbases))
+        for stat in after.compare_to(self.before, 'lineno')[:TOP_LINES]:
+            if stat.size_diff > 0:
+                lines.append('  {:>9} in {} blocks {}'.format(
+                    size(stat.size_diff), stat.count_diff, format_line(stat.traceback)))
+
+        # Turn to turn growth
+        if self.last_traced is not None:
+            self.growth.append(traced - self.last_traced)
+            recent = self.growth[-LEAK_TURNS:]
+            if len(recent) == LEAK_TURNS and min(recent) > 0 and sum(recent) > LEAK_BYTES:
+                lines.append('  WARNING: traced memory grew {} over the last {} turns, most in:'.format(
+                    size(sum(recent)), LEAK_TURNS))
+                for stat in after.compare_to(self.last, 'lineno')[:TOP_LINES]:
+                    if stat.size_diff > 0:
+                        lines.append('  {:>9} {}'.format(size(stat.size_diff), format_line(stat.traceback)))
+        self.last, self.last_traced = after, traced
+        return lines
+
+    # This function returns how much the big structures hold: the whole
+    # table, it is allocated up front, and the resident part of the files
+    def resident(self, tt=None, book=None, bitbases=None):
+        parts = []
+        if tt is not None:
+            parts.append('tt {}'.format(size(tt.memory())))
+        if book is not None:
+            parts.append('book {} of {}'.format(size(mapped_rss([book.file.name])), size(len(book.data))))
+        if bitbases is not None:
+            mapped = sum(len(table) for tables in bitbases.tables.values() for table in tables if table is not None)
+            parts.append('bitbases {} of {}'.format(size(mapped_rss([f.name for f in bitbases.files])), size(mapped)))
+        return ', '.join(parts)
+
+    def close(self):
+        tracemalloc.stop()
+
+
+# This function returns a traceback's innermost frame as file:line
+def format_line(traceback):
+    frame = traceback[0]
+    return '{}:{}'.format(os.path.relpath(frame.filename), frame.lineno)
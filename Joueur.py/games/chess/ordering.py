@@ -0,0 +1,99 @@
+"""
+Move ordering for the alpha-beta search. Alpha-beta cuts off the most when the
+best move is searched first, so before a node's moves are searched they are
+sorted by how likely each one is to be best:
+
+    1. the move stored for the position in the transposition table
+    2. captures, most valuable victim first and then least valuable attacker
+    3. the killer moves of the ply, quiet moves that cut off a sibling node
+    4. the countermove, the quiet move that last refuted the previous move
+    5. the other quiet moves, by their history score
+
+Moves are the (from, to) tuples of any backend. The squares of every backend
+fit in 7 bits, so history and countermoves are keyed by from << 7 | to.
+"""
+
+# Ordering value of a piece as a victim or an attacker
+ORDER_VALUE = {'.': 0, 'P': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}
+
+# Sort keys of the move classes, all far above any history score
+HASH_MOVE = 1 << 30
+CAPTURE = 1 << 28
+KILLER = 1 << 27
+COUNTERMOVE = 1 << 26
+# History scores are halved when they reach this so they stay below the killers
+HISTORY_MAX = 1 << 24
+
+# Deepest ply killers are kept for
+MAX_PLY = 128
+# Cutoffs are counted by the index of the move that cut off, the last slot
+# counts every move from that index on
+CUTOFF_SLOTS = 8
+
+
+class MoveOrdering:
+
+    def __init__(self):
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [0] * (1 << 14)
+        self.countermoves = {}
+        # Nodes that failed high, in all and by the index of the move that did
+        self.cutoffs = 0
+        self.cutoff_moves = [0] * CUTOFF_SLOTS
+
+    # Called before every search: killers are forgotten, history is kept but
+    # halved so it follows the current position
+    def new_search(self):
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [h >> 1 for h in self.history]
+        self.cutoffs = 0
+        self.cutoff_moves = [0] * CUTOFF_SLOTS
+
+    # Fraction of the cutoffs that came from the first move searched
+    def first_move_cutoff_rate(self):
+        return self.cutoff_moves[0] / self.cutoffs if self.cutoffs else 0.0
+
+    # This function returns the moves sorted best first for the node at ply,
+    # given the move from the transposition table and the move that led here
+    def order(self, state, moves, hash_move=None, ply=0, prev=None):
+        killers = self.killers[ply] if ply < MAX_PLY else (None, None)
+        counter = self.countermoves.get(prev[0] << 7 | prev[1]) if prev else None
+        history = self.history
+        piece_on = state.piece_on
+        keys = {}
+        for move in moves:
+            if move == hash_move:
+                keys[move] = HASH_MOVE
+                continue
+            victim = piece_on(move[1])
+            if victim != '.':
+                keys[move] = CAPTURE + ORDER_VALUE[victim] * 8 - ORDER_VALUE[piece_on(move[0])]
+            elif move == killers[0]:
+                keys[move] = KILLER + 1
+            elif move == killers[1]:
+                keys[move] = KILLER
+            elif move == counter:
+                keys[move] = COUNTERMOVE
+            else:
+                keys[move] = history[move[0] << 7 | move[1]]
+        return sorted(moves, key=keys.__getitem__, reverse=True)
+
+    # This function records a beta cutoff by move at ply, the n-th move searched
+    # at a node of the given remaining depth. A quiet move becomes a killer,
+    # the countermove of prev and gains history.
+    def cutoff(self, state, move, n, depth, ply, prev=None):
+        self.cutoffs += 1
+        self.cutoff_moves[n if n < CUTOFF_SLOTS else CUTOFF_SLOTS - 1] += 1
+        if state.piece_on(move[1]) != '.':
+            return
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        if prev:
+            self.countermoves[prev[0] << 7 | prev[1]] = move
+        key = move[0] << 7 | move[1]
+        self.history[key] += depth * depth
+        if self.history[key] >= HISTORY_MAX:
+            self.history = [h >> 1 for h in self.history]
@@ -0,0 +1,201 @@
+import argparse
+import multiprocessing
+import sys
+import time
+
+"""
+Perft counts the leaf nodes of the legal move tree of a position to a fixed
+depth. Two move generators that agree on perft for a set of positions agree
+on every move along the way, so this is how the backends are checked against
+each other and against the published counts of the reference positions in
+SUITE. Counting is also the purest measure of how fast a backend generates
+and plays moves, so every command reports nodes per second.
+
+The last ply isn't played: the number of legal moves of a position is the
+number of leaves below it (bulk counting). Root moves can be split over a
+pool of processes, each of which loads the position from its FEN again, plays
+its share of the root moves and counts below them.
+
+    python -m games.chess.perft suite [depth] [--backend B] [--processes N]
+    python -m games.chess.perft perft depth [fen] [--backend B] [--processes N]
+    python -m games.chess.perft divide depth [fen] [--backend B] [--processes N]
+    python -m games.chess.perft compare depth [fens...]
+"""
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Reference positions with their published perft counts from depth 1 on
+SUITE = [
+    ('start', START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    # castling on both wings, pins and en passant all at once
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603]),
+    # en passant captures that uncover a check along the rank
+    ('endgame', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624]),
+    # promotions and underpromotions with captures, castling rights of one side
+    ('promotions', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333]),
+    # a promotion that gives check, castling through an attacked square
+    ('checks', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487]),
+    ('middlegame', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594]),
+]
+
+
+# This function returns the fen loader of a backend by name
+def loader(backend):
+    from games.chess.ai import BACKENDS
+    return BACKENDS[backend]
+
+
+# This function returns the color to move in a FEN, for to_uci
+def fen_color(fen):
+    return 'white' if fen.split()[1] == 'w' else 'black'
+
+
+# Counts the legal move sequences of the given length from state
+def perft(state, depth):
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return len(list(state.generate_legal_moves()))
+    nodes = 0
+    for move in state.generate_legal_moves():
+        nodes += perft(state.move(move), depth - 1)
+        state.unmove()
+    return nodes
+
+
+# Returns the perft count below each legal root move, keyed by its UCI string
+def divide(state, depth, color):
+    counts = {}
+    for move in list(state.generate_legal_moves()):
+        uci = state.to_uci(move, color)
+        counts[uci] = perft(state.move(move), depth - 1)
+        state.unmove()
+    return counts
+
+
+# Counts below one root move in a process of the pool
+def _count_move(job):
+    backend, fen, move, depth = job
+    return perft(loader(backend)(fen).move(move), depth - 1)
+
+
+# Same as divide, but for a FEN whose root moves are split over a pool of
+# processes. With one process everything is counted here.
+def parallel_divide(fen, depth, backend='mailbox', processes=None):
+    state = loader(backend)(fen)
+    color = fen_color(fen)
+    moves = list(state.generate_legal_moves())
+    names = [state.to_uci(move, color) for move in moves]
+    if depth <= 1:
+        return dict((name, 1) for name in names)
+    processes = processes or multiprocessing.cpu_count()
+    if processes <= 1:
+        return divide(state, depth, color)
+    pool = multiprocessing.Pool(min(processes, len(moves)))
+    try:
+        counts = pool.map(_count_move, [(backend, fen, move, depth) for move in moves], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(names, counts))
+
+
+# Runs perft on a FEN and returns the (nodes, seconds) it took
+def timed_perft(fen, depth, backend='mailbox', processes=None):
+    start = time.perf_counter()
+    if depth <= 1:
+        nodes = perft(loader(backend)(fen), depth)
+    else:
+        nodes = sum(parallel_divide(fen, depth, backend, processes).values())
+    return nodes, time.perf_counter() - start
+
+
+# Runs every reference position of the suite up to depth (or the deepest
+# count it has) and prints each count against the expected one. Returns True
+# if all of them match.
+def run_suite(depth=3, backend='mailbox', processes=None, suite=SUITE):
+    ok = True
+    total_nodes, total_time = 0, 0.0
+    for name, fen, expected in suite:
+        for d in range(1, min(depth, len(expected)) + 1):
+            nodes, elapsed = timed_perft(fen, d, backend, processes)
+            total_nodes += nodes
+            total_time += elapsed
+            passed = nodes == expected[d - 1]
+            ok = ok and passed
+            print('{:<11} depth {} {:>10} {:<8} {:>7.2f}s {:>9.0f} nps'.format(
+                name, d, nodes, 'ok' if passed else '!= {}'.format(expected[d - 1]), elapsed,
+                nodes / elapsed if elapsed else 0))
+    print('{} {}: {} nodes in {:.2f}s, {:.0f} nps'.format(
+        backend, 'passed' if ok else 'FAILED', total_nodes, total_time,
+        total_nodes / total_time if total_time else 0))
+    return ok
+
+
+# Runs perft with every backend on a FEN and prints where a backend's divide
+# differs from the mailbox State
+def compare(fen, depth):
+    from games.chess.ai import BACKENDS
+    color = fen_color(fen)
+    backends = sorted(BACKENDS.items(), key=lambda backend: backend[0] != 'mailbox')
+    states = [load(fen) for name, load in backends]
+    assert len(set(state.hash for state in states)) == 1
+    results, report = [], []
+    for (name, load), state in zip(backends, states):
+        start = time.perf_counter()
+        nodes = perft(state, depth)
+        elapsed = time.perf_counter() - start
+        results.append(nodes)
+        report.append('{} {} ({:.0f} nps)'.format(name, nodes, nodes / elapsed))
+    print('{} depth {}: {}'.format(fen, depth, ', '.join(report)))
+    if len(set(results)) == 1:
+        return True
+    reference = divide(states[0], depth, color)
+    for (name, load), state, nodes in zip(backends[1:], states[1:], results[1:]):
+        if nodes == results[0]:
+            continue
+        counts = divide(state, depth, color)
+        for move in sorted(set(reference) | set(counts)):
+            if reference.get(move) != counts.get(move):
+                print('  {}: mailbox {} {} {}'.format(move, reference.get(move), name, counts.get(move)))
+    return False
+
+
+def main(argv):
+    from games.chess.ai import BACKENDS
+    parser = argparse.ArgumentParser(prog='python -m games.chess.perft', description='Perft and divide')
+    parser.add_argument('command', choices=['suite', 'perft', 'divide', 'compare'])
+    parser.add_argument('depth', type=int, nargs='?', default=3)
+    parser.add_argument('fens', nargs='*', help='FEN strings, quoted')
+    parser.add_argument('--backend', default='mailbox', choices=sorted(BACKENDS))
+    parser.add_argument('--processes', type=int, default=None, help='defaults to the number of CPUs')
+    args = parser.parse_args(argv)
+
+    if args.command == 'suite':
+        return run_suite(args.depth, args.backend, args.processes)
+    if args.command == 'compare':
+        fens = args.fens or [fen for name, fen, expected in SUITE]
+        return all([compare(fen, args.depth) for fen in fens])
+    for fen in args.fens or [START_FEN]:
+        start = time.perf_counter()
+        if args.command == 'divide':
+            counts = parallel_divide(fen, args.depth, args.backend, args.processes)
+            for move in sorted(counts):
+                print('{}: {}'.format(move, counts[move]))
+            nodes = sum(counts.values())
+        else:
+            nodes, _ = timed_perft(fen, args.depth, args.backend, args.processes)
+        elapsed = time.perf_counter() - start
+        print('{} depth {}: {} nodes in {:.2f}s, {:.0f} nps'.format(
+            fen, args.depth, nodes, elapsed, nodes / elapsed if elapsed else 0))
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(sys.argv[1:]) else 1)
@@ -0,0 +1,86 @@
+"""
+Pondering: thinking on the opponent's time. Once our move is sent, the client
+only waits on the socket until the opponent has replied, which leaves the CPU
+idle. A Ponderer guesses that reply, the hash move of the position after our
+move, and searches the position after it in a background thread until the
+reply arrives. The thread searches with the AI's own Searcher, so its
+transposition table, history and countermoves are warm when the guess was
+right. On such a hit the real search also carries on from the depth, best
+move and score the ponder search finished, or plays its move right away if
+it got as deep as the move's time budget would.
+
+Waiting on the socket releases the GIL, so the ponder thread gets nearly all
+of the CPU while the main thread waits.
+"""
+import threading
+
+from games.chess.transposition import entry_move
+
+
+class Ponderer:
+
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.thread = None
+        # UCI string of the reply being pondered on and the length game.history
+        # will have once it is played
+        self.expected = None
+        self.expected_ply = None
+        # (depth, score, best move, seconds) of the ponder search after a hit
+        self.result = None
+
+    # This function starts pondering after our best_move was played on board,
+    # the position ply moves into the game, with color to move. history has
+    # the hashes of the positions played up to board. Nothing is started if
+    # the table has no legal guess for the reply.
+    def start(self, board, best_move, color, ply, history=()):
+        self.stop()
+        self.result = None
+        opponent = 'black' if color == 'white' else 'white'
+        child = board.move(best_move)
+        reply = entry_move(self.searcher.tt.probe(child.hash))
+        # the stored move may come from another position with a colliding slot
+        if reply is None or reply not in list(child.generate_legal_moves()):
+            return False
+        self.expected = child.to_uci(reply, opponent)
+        self.expected_ply = ply + 2
+        history = list(history) + [child.hash]
+        position = child.move(reply)
+        self.thread = threading.Thread(target=self.searcher.search, args=(position, float('inf')),
+                                       kwargs={'history': history})
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    # This function is called with game.history on every update. Once the
+    # opponent's reply is known the ponder search is stopped, and True is
+    # returned if it was the one we pondered on, False if not and None if the
+    # reply isn't in yet. On a hit the ponder search's result is kept for
+    # take_result().
+    def check(self, history):
+        if self.thread is None or len(history) < self.expected_ply:
+            return None
+        self.stop()
+        hit = history[self.expected_ply - 1] == self.expected
+        searcher = self.searcher
+        if hit and searcher.depth and searcher.best_move is not None:
+            self.result = (searcher.depth, searcher.score, searcher.best_move, searcher.iteration_times[-1])
+        return hit
+
+    # This function returns the (depth, score, best move, seconds) the ponder
+    # search got to on the position we have to move in after a hit, once, or
+    # None
+    def take_result(self):
+        result, self.result = self.result, None
+        return result
+
+    # This function stops the ponder search and waits for its thread to end.
+    # The deadline is set again until it does, as the search sets its own one
+    # when it starts and the thread may not have got that far yet.
+    def stop(self):
+        if self.thread is None:
+            return
+        while self.thread.is_alive():
+            self.searcher.deadline = float('-inf')
+            self.thread.join(0.01)
+        self.thread = None
@@ -0,0 +1,476 @@
+from games.chess.state import (zobrist, zobrist_ep, zobrist_wc, zobrist_bc, swap_halves, see,
+                               knight_squares, king_squares, orthogonal_rays, diagonal_rays, piece_rays,
+                               KING_ZONE_ATTACK, SQUARE_INDEX, UNDERPROMOTIONS,
+                               A1, H1, A8, H8, N, E, S, W, dir, ORTHOGONAL, DIAGONAL)
+from games.chess.helper import convert_san
+from games.chess.pst import pst, taper, PHASE
+
+"""
+A mutable 10x12 mailbox position. Unlike State, which builds a new board
+string for every move and rotates it for the next player, a Position changes
+one bytearray in place with make_move() and puts it back with unmake_move().
+Everything a move overwrites (captured piece, castling rights, en passant
+square, hash and score) is pushed on an undo stack, so taking a move back is O(1).
+The board is never rotated, white is always uppercase and the side to move is
+kept in the white flag.
+"""
+
+
+# Squares the kings start on
+E1, E8 = 95, 25
+
+# Byte values of the board squares
+EMPTY = ord('.')
+WHITE_PAWN, BLACK_PAWN = ord('P'), ord('p')
+WHITE_KING, BLACK_KING = ord('K'), ord('k')
+
+# The move tables of State keyed by the byte of either color. The board isn't
+# rotated, but apart from pawns every piece moves the same way for both colors.
+piece_rays_by_byte = {}
+for p, rays in piece_rays.items():
+    piece_rays_by_byte[ord(p)] = piece_rays_by_byte[ord(p.lower())] = rays
+
+# Bytes of the pieces of each color that can attack a square, as
+# (knight, king, pawn, rook or queen, bishop or queen, pawn attack offsets).
+# attackers[True] are white's, whose pawns attack sq from the south.
+attackers = {
+    True: (ord('N'), ord('K'), ord('P'), (ord('R'), ord('Q')), (ord('B'), ord('Q')), (S + W, S + E)),
+    False: (ord('n'), ord('k'), ord('p'), (ord('r'), ord('q')), (ord('b'), ord('q')), (N + W, N + E)),
+}
+
+
+# This function checks if any piece of the given color attacks square sq, with
+# the attack patterns of State
+def _attacked(board, sq, white):
+    knight, king, pawn, rook, bishop, pawn_from = attackers[white]
+    if board[sq + pawn_from[0]] == pawn or board[sq + pawn_from[1]] == pawn: return True
+    for j in knight_squares[sq]:
+        if board[j] == knight: return True
+    for j in king_squares[sq]:
+        if board[j] == king: return True
+    for ray in orthogonal_rays[sq]:
+        for j in ray:
+            q = board[j]
+            if q != EMPTY:
+                if q in rook: return True
+                break
+    for ray in diagonal_rays[sq]:
+        for j in ray:
+            q = board[j]
+            if q != EMPTY:
+                if q in bishop: return True
+                break
+    return False
+
+
+# Castling right bits, same letters as in FEN
+CASTLE_K, CASTLE_Q, CASTLE_k, CASTLE_q = 1, 2, 4, 8
+# Rights lost when a piece leaves or lands on these squares
+castle_mask = [0] * 120
+castle_mask[A1], castle_mask[H1], castle_mask[E1] = CASTLE_Q, CASTLE_K, CASTLE_K | CASTLE_Q
+castle_mask[A8], castle_mask[H8], castle_mask[E8] = CASTLE_q, CASTLE_k, CASTLE_k | CASTLE_q
+
+# Zobrist keys in the white to move orientation of State, so a Position hashes
+# to the same key as the State of the same position
+zobrist_pos = [None] * 128
+for p in 'PNBRQKpnbrqk':
+    zobrist_pos[ord(p)] = zobrist[p]
+# Piece-square scores of State keyed by byte, white's view like the board
+pst_pos = [None] * 128
+for p in 'PNBRQKpnbrqk.':
+    pst_pos[ord(p)] = pst[p]
+zobrist_castle = [0] * 16
+for rights in range(16):
+    h = 0
+    if rights & CASTLE_Q: h ^= zobrist_wc[0]
+    if rights & CASTLE_K: h ^= zobrist_wc[1]
+    if rights & CASTLE_k: h ^= zobrist_bc[0]
+    if rights & CASTLE_q: h ^= zobrist_bc[1]
+    zobrist_castle[rights] = h
+
+# Piece bytes of each color in the order of State.PIECES, the keys of the piece
+# lists of a Position
+WHITE_PIECES = tuple(ord(p) for p in 'PNBRQK')
+BLACK_PIECES = tuple(ord(p) for p in 'pnbrqk')
+
+
+class Position:
+
+    def __init__(self, board, white, castling, ep):
+        self.board = bytearray(board, 'ascii') if isinstance(board, str) else bytearray(board)
+        self.white = white
+        self.castling = castling
+        self.ep = ep
+        self.captured = None
+        self.stack = []
+        # The set of squares of every piece byte, kept up to date by make_move
+        # and unmake_move so generation and scoring skip the empty squares
+        self.squares = {p: set() for p in WHITE_PIECES + BLACK_PIECES}
+        for i, p in enumerate(self.board):
+            if p in self.squares:
+                self.squares[p].add(i)
+        # The piece-square score of State.score, but always from white's view
+        self.score = sum(pst_pos[p][i] for i, p in enumerate(self.board) if pst_pos[p])
+        key = zobrist_castle[castling] ^ zobrist_ep[ep]
+        for i, p in enumerate(self.board):
+            if zobrist_pos[p]:
+                key ^= zobrist_pos[p][i]
+        self.key = key
+        self.hash = key if white else swap_halves(key)
+
+    # Generates all pseudo-legal moves of the side to move. The list is built up
+    # front because the board may change while the caller walks over it.
+    def generate_moves(self):
+        board, white = self.board, self.white
+        moves = []
+        if white:
+            up, lo, hi, pawn, home = N, 65, 90, WHITE_PAWN, (81, 88)
+        else:
+            up, lo, hi, pawn, home = S, 97, 122, BLACK_PAWN, (31, 38)
+        ep = self.ep
+        squares = self.squares
+        for i in squares[pawn]:
+            j = i + up
+            # a pawn one step from the last rank also promotes to a knight, bishop or rook
+            promotes = A8 <= j <= H8 or A1 <= j <= H1
+            if board[j] == EMPTY:
+                moves.append((i, j))
+                if promotes:
+                    moves.extend((i, j, promotion) for promotion in UNDERPROMOTIONS)
+                elif home[0] <= i <= home[1] and board[j + up] == EMPTY:
+                    moves.append((i, j + up))
+            for j in (i + up + W, i + up + E):
+                q = board[j]
+                # an enemy piece, the bytes of ' ' and '\n' are below '.'
+                if (q > EMPTY and not lo <= q <= hi) or j == ep:
+                    moves.append((i, j))
+                    if promotes:
+                        moves.extend((i, j, promotion) for promotion in UNDERPROMOTIONS)
+        for p in (WHITE_PIECES if white else BLACK_PIECES)[1:]:
+            for i in squares[p]:
+                for ray in piece_rays_by_byte[p][i]:
+                    for j in ray:
+                        q = board[j]
+                        if lo <= q <= hi:
+                            break
+                        moves.append((i, j))
+                        if q != EMPTY:
+                            break
+
+        # Castling, the squares between king and rook have to be empty
+        castling = self.castling
+        if white:
+            if castling & CASTLE_K and board[96] == board[97] == EMPTY:
+                moves.append((E1, E1 + 2))
+            if castling & CASTLE_Q and board[92] == board[93] == board[94] == EMPTY:
+                moves.append((E1, E1 - 2))
+        else:
+            if castling & CASTLE_k and board[26] == board[27] == EMPTY:
+                moves.append((E8, E8 + 2))
+            if castling & CASTLE_q and board[22] == board[23] == board[24] == EMPTY:
+                moves.append((E8, E8 - 2))
+        return moves
+
+    # Generates the pseudo-legal captures and promotions, the moves the
+    # quiescence search plays out
+    def generate_captures(self):
+        board, ep = self.board, self.ep
+        # like the other backends only the promotions to a queen
+        return [move for move in self.generate_moves() if len(move) == 2 and (
+            board[move[1]] != EMPTY or ((board[move[0]] == WHITE_PAWN or board[move[0]] == BLACK_PAWN)
+                                        and (move[1] == ep or A8 <= move[1] <= H8 or A1 <= move[1] <= H1)))]
+
+    # This function returns the static exchange evaluation of a capture. The
+    # State function expects the side to move in uppercase at the bottom, so
+    # with black to move the board is rotated the way a State would see it.
+    def see(self, move):
+        if self.white:
+            return see(self.board.decode(), move)
+        i, j = move[0], move[1]
+        return see(self.board[::-1].decode().swapcase(), (119 - i, 119 - j))
+
+    # Generates only the legal moves, the same way as State.generate_legal_moves
+    # but for either color: checkers and pins are found once from our king, a
+    # pinned piece only moves along its pin, a single check has to be captured or
+    # blocked and in double check only the king moves.
+    def generate_legal_moves(self):
+        board, white = self.board, self.white
+        k = board.find(WHITE_KING if white else BLACK_KING)
+        if k < 0:
+            return []
+        lo, hi = (65, 90) if white else (97, 122)
+        knight, king, pawn, rook, bishop, pawn_from = attackers[not white]
+
+        # pinned maps a pinned square to the squares it may still move to, checks
+        # are the squares that capture a checker or block its line
+        pinned, checkers, checks = {}, 0, set()
+        for d in ORTHOGONAL + DIAGONAL:
+            sliders = rook if d in ORTHOGONAL else bishop
+            ours = 0
+            j = k + d
+            while True:
+                q = board[j]
+                if q == EMPTY:
+                    j += d
+                    continue
+                if lo <= q <= hi and not ours:
+                    ours = j
+                    j += d
+                    continue
+                if q in sliders:
+                    if ours:
+                        pinned[ours] = range(k + d, j + d, d)
+                    else:
+                        checkers += 1
+                        checks.update(range(k + d, j + d, d))
+                break
+        for d in dir['N']:
+            if board[k + d] == knight:
+                checkers += 1
+                checks.add(k + d)
+        for d in pawn_from:
+            if board[k + d] == pawn:
+                checkers += 1
+                checks.add(k + d)
+
+        moves = []
+        # The king, taken off its square so a checking slider covers the squares behind it
+        board[k] = EMPTY
+        for d in dir['K']:
+            q = board[k + d]
+            if (q == EMPTY or (q > EMPTY and not lo <= q <= hi)) and not _attacked(board, k + d, not white):
+                moves.append((k, k + d))
+        board[k] = WHITE_KING if white else BLACK_KING
+        if checkers > 1:
+            return moves
+
+        for move in self.generate_moves():
+            i, j = move[0], move[1]
+            if i == k:
+                # castling, not out of, through or into check
+                if abs(j - i) == 2 and not checkers and not _attacked(board, (i + j) // 2, not white) \
+                        and not _attacked(board, j, not white):
+                    moves.append((i, j))
+                continue
+            pin = pinned.get(i)
+            if pin and j not in pin:
+                continue
+            if board[j] == EMPTY and j == self.ep and board[i] in (WHITE_PAWN, BLACK_PAWN):
+                # en passant can uncover a check along the rank, so it is
+                # simply played and looked at
+                if not self.move((i, j)).check_check():
+                    moves.append((i, j))
+                self.unmove()
+                continue
+            if not checkers or j in checks:
+                moves.append(move)
+        return moves
+
+    # Plays the move on the board and hands the turn to the other side
+    def make_move(self, move):
+        i, j = move[0], move[1]
+        board = self.board
+        p, q = board[i], board[j]
+        self.stack.append((move, p, q, self.castling, self.ep, self.key, self.hash, self.captured, self.score))
+        key = self.key ^ zobrist_castle[self.castling] ^ zobrist_ep[self.ep]
+        squares = self.squares
+        board[j] = p
+        board[i] = EMPTY
+        squares[p].remove(i)
+        squares[p].add(j)
+        key ^= zobrist_pos[p][i] ^ zobrist_pos[p][j]
+        score = self.score + pst_pos[p][j] - pst_pos[p][i]
+        if q != EMPTY:
+            key ^= zobrist_pos[q][j]
+            score -= pst_pos[q][j]
+            squares[q].remove(j)
+        ep = 0
+        if p == WHITE_PAWN or p == BLACK_PAWN:
+            if j == self.ep:
+                # en passant, the captured pawn sits behind the target square
+                k = j + S if p == WHITE_PAWN else j + N
+                q = board[k]
+                key ^= zobrist_pos[q][k]
+                score -= pst_pos[q][k]
+                board[k] = EMPTY
+                squares[q].remove(k)
+            elif abs(j - i) == 20:
+                ep = (i + j) // 2
+            elif A8 <= j <= H8 or A1 <= j <= H1:
+                # Promote the pawn to Queen unless the move names another piece
+                promotion = move[2] if len(move) > 2 else 'Q'
+                piece = ord(promotion) if p == WHITE_PAWN else ord(promotion.lower())
+                board[j] = piece
+                squares[p].remove(j)
+                squares[piece].add(j)
+                key ^= zobrist_pos[p][j] ^ zobrist_pos[piece][j]
+                score += pst_pos[piece][j] - pst_pos[p][j]
+        elif (p == WHITE_KING or p == BLACK_KING) and abs(j - i) == 2:
+            # Castling, bring the rook over to the other side of the king
+            r_from, r_to = (i + 3, i + 1) if j > i else (i - 4, i - 1)
+            rook = board[r_from]
+            board[r_to] = rook
+            board[r_from] = EMPTY
+            squares[rook].remove(r_from)
+            squares[rook].add(r_to)
+            key ^= zobrist_pos[rook][r_from] ^ zobrist_pos[rook][r_to]
+            score += pst_pos[rook][r_to] - pst_pos[rook][r_from]
+        castling = self.castling & ~(castle_mask[i] | castle_mask[j])
+        key ^= zobrist_castle[castling] ^ zobrist_ep[ep]
+
+        self.castling, self.ep, self.key, self.score = castling, ep, key, score
+        self.white = white = not self.white
+        self.hash = key if white else swap_halves(key)
+        self.captured = chr(q).upper()
+
+    # Passes the turn without moving, for null-move pruning. unmake_move takes
+    # it back like any other move.
+    def make_null_move(self):
+        self.stack.append((None, EMPTY, EMPTY, self.castling, self.ep, self.key, self.hash, self.captured,
+                           self.score))
+        key = self.key ^ zobrist_ep[self.ep]
+        self.ep, self.key = 0, key
+        self.white = white = not self.white
+        self.hash = key if white else swap_halves(key)
+        self.captured = None
+
+    # Takes back the last move played with make_move or make_null_move
+    def unmake_move(self):
+        move, p, q, self.castling, self.ep, self.key, self.hash, self.captured, self.score = self.stack.pop()
+        if move is None:
+            self.white = not self.white
+            return
+        i, j = move[0], move[1]
+        board, squares = self.board, self.squares
+        # a promoted pawn comes back off its new piece's list
+        squares[board[j]].remove(j)
+        squares[p].add(i)
+        board[i] = p
+        board[j] = q
+        if q != EMPTY:
+            squares[q].add(j)
+        self.white = white = not self.white
+        if p == WHITE_PAWN or p == BLACK_PAWN:
+            if j == self.ep:
+                k, pawn = (j + S, BLACK_PAWN) if white else (j + N, WHITE_PAWN)
+                board[k] = pawn
+                squares[pawn].add(k)
+        elif (p == WHITE_KING or p == BLACK_KING) and abs(j - i) == 2:
+            r_from, r_to = (i + 3, i + 1) if j > i else (i - 4, i - 1)
+            rook = board[r_to]
+            board[r_from] = rook
+            board[r_to] = EMPTY
+            squares[rook].remove(r_to)
+            squares[rook].add(r_from)
+
+    # These let the search drive a Position through the same calls as a State:
+    # move() returns the position after the move and unmove() takes it back
+    def move(self, move):
+        self.make_move(move)
+        return self
+
+    def unmove(self):
+        self.unmake_move()
+
+    def null_move(self):
+        self.make_null_move()
+        return self
+
+    # This function checks if the side to move has a piece other than pawns and
+    # the king, without which passing the turn is often the best move
+    def has_non_pawn_material(self):
+        squares = self.squares
+        for p in (WHITE_PIECES if self.white else BLACK_PIECES)[1:5]:
+            if squares[p]:
+                return True
+        return False
+
+    # The number of pieces on the board, kings included
+    def men(self):
+        return sum(map(len, self.squares.values()))
+
+    # Every piece on the board as the side to move sees it, see State.piece_squares
+    def piece_squares(self):
+        if self.white:
+            return [(chr(p), SQUARE_INDEX[i]) for p, squares in self.squares.items() for i in squares]
+        return [(chr(p).swapcase(), SQUARE_INDEX[119 - i]) for p, squares in self.squares.items() for i in squares]
+
+    # This function returns the uppercase letter of the piece on the square, of
+    # either side, or '.' if it is empty
+    def piece_on(self, square):
+        return chr(self.board[square]).upper()
+
+    # This function checks if a move is a pawn reaching the last rank
+    def promotes(self, move):
+        j = move[1]
+        return self.board[move[0]] in (WHITE_PAWN, BLACK_PAWN) and (A8 <= j <= H8 or A1 <= j <= H1)
+
+    # This function checks if a piece of by_side attacks the square. Like on
+    # State, by_side is True for the side to move and False for the opponent.
+    def is_square_attacked(self, square, by_side):
+        return _attacked(self.board, square, self.white == by_side)
+
+    # This function checks if the side to move can capture the opponent's king
+    def check_check(self):
+        k = self.board.find(BLACK_KING if self.white else WHITE_KING)
+        return k >= 0 and _attacked(self.board, k, self.white)
+
+    # This function checks if the side to move is in check
+    def in_check(self):
+        k = self.board.find(WHITE_KING if self.white else BLACK_KING)
+        return k >= 0 and _attacked(self.board, k, not self.white)
+
+    # This function returns the king zone penalty of State.king_safety for white
+    def king_safety(self):
+        board = self.board
+        score = 0
+        k = board.find(WHITE_KING)
+        if k >= 0:
+            for j in king_squares[k]:
+                if _attacked(board, j, False): score -= KING_ZONE_ATTACK
+        k = board.find(BLACK_KING)
+        if k >= 0:
+            for j in king_squares[k]:
+                if _attacked(board, j, True): score += KING_ZONE_ATTACK
+        return score
+
+    # This function scores the position for the side to move like State.evaluate
+    def evaluate(self):
+        squares = self.squares
+        phase = 0
+        for p, white, black in zip('NBRQ', WHITE_PIECES[1:], BLACK_PIECES[1:]):
+            phase += PHASE[p] * (len(squares[white]) + len(squares[black]))
+        if self.white:
+            return taper(self.score, phase) + self.king_safety()
+        return taper(-self.score, phase) - self.king_safety()
+
+    # Converts a move into UCI notation. The color argument is only there to
+    # match State.to_uci, a Position knows its own side.
+    def to_uci(self, move, color=None):
+        i, j = move[0], move[1]
+        promotion = ''
+        if self.board[i] in (WHITE_PAWN, BLACK_PAWN) and (A8 <= j <= H8 or A1 <= j <= H1):
+            promotion = move[2].lower() if len(move) > 2 else 'q'
+        return (convert_san(i).file + str(convert_san(i).rank)
+                + convert_san(j).file + str(convert_san(j).rank) + promotion)
+
+
+# This function returns a Position by parsing the given fen string
+def fen_to_position(fen_string):
+    board, player, castling, enpassant, halfmove, move = fen_string.split()
+    board_out = '         \n         \n'
+    for row in board.split('/'):
+        board_out += ' '
+        for piece in row:
+            board_out += '.' * int(piece) if piece.isdigit() else piece
+        board_out += '\n'
+    board_out += '         \n         \n'
+
+    rights = 0
+    for c, bit in (('K', CASTLE_K), ('Q', CASTLE_Q), ('k', CASTLE_k), ('q', CASTLE_q)):
+        if c in castling:
+            rights |= bit
+    ep = 0
+    if enpassant != '-':
+        ep = A1 + ord(enpassant[0]) - ord('a') - 10 * (int(enpassant[1]) - 1)
+    return Position(board_out, player == 'w', rights, ep)
@@ -0,0 +1,107 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+"""
+A sampling profiler for real games, switched on with --aiSettings profile=1.
+cProfile hooks every call, which makes the small functions of move generation
+look far more expensive than they are. This profiler instead wakes up a
+background thread every INTERVAL seconds while make_move runs and records the
+stack of the thread searching, from sys._current_frames(). The search itself
+runs exactly as without the profiler, only with a thread that takes the GIL
+for a moment between samples.
+
+Stacks are written in the collapsed format of flamegraph.pl, speedscope and
+similar tools: one line per distinct stack, its frames from the outermost to
+the innermost joined by ';', then the number of samples. Every turn gets its
+own file and game.folded adds up all of them, in a directory of its own for
+every game under profiledir=<directory>. Frames are named function (file:line)
+with the line the function starts on, so every function is one frame however
+many lines of it were sampled.
+
+The thread can only take a sample when the searching thread gives up the GIL,
+which Python makes it do every sys.getswitchinterval() seconds (5 ms unless
+changed), so INTERVAL below that doesn't give more samples.
+"""
+
+# Seconds between two samples
+INTERVAL = 0.005
+
+
+class Profiler:
+
+    def __init__(self, directory, interval=INTERVAL, root=None):
+        self.directory = directory
+        self.interval = interval
+        # code object of the function stacks are cut at, so the client's
+        # event loop below make_move isn't in every one of them
+        self.root = root
+        self.game = Counter()
+        self.turn = None
+        self.turns = 0
+        self.thread = None
+        self.stop_sampling = threading.Event()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    # This function returns the collapsed stack of a frame, outermost first
+    def collapse(self, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            if code is self.root:
+                break
+            frame = frame.f_back
+        names.reverse()
+        return ';'.join(names)
+
+    # Runs in the sampling thread until stop_sampling is set
+    def sample(self, thread_id, samples):
+        while not self.stop_sampling.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                samples[self.collapse(frame)] += 1
+
+    # Starts sampling the calling thread for a new turn
+    def start(self):
+        self.stop()
+        self.turn = Counter()
+        self.turns += 1
+        self.stop_sampling.clear()
+        self.thread = threading.Thread(target=self.sample, args=(threading.get_ident(), self.turn))
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Stops sampling, writes the turn's stacks and returns the number of
+    # samples and the file they went to
+    def stop(self):
+        if self.thread is None:
+            return 0, None
+        self.stop_sampling.set()
+        self.thread.join()
+        self.thread = None
+        self.game.update(self.turn)
+        path = os.path.join(self.directory, 'turn-{:03d}.folded'.format(self.turns))
+        write_folded(path, self.turn)
+        return sum(self.turn.values()), path
+
+    # Stops sampling and writes the stacks of the whole game
+    def close(self):
+        self.stop()
+        write_folded(os.path.join(self.directory, 'game.folded'), self.game)
+
+
+# This function writes stack counts in the collapsed format, most samples first
+def write_folded(path, samples):
+    with open(path, 'w') as f:
+        for stack, count in samples.most_common():
+            f.write('{} {}\n'.format(stack, count))
+
+
+# This function returns a directory for the profiles of a new game under
+# directory, named after the color played and the time
+def game_directory(directory, color):
+    return os.path.join(directory, '{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), color))
@@ -0,0 +1,252 @@
+import argparse
+import io
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+"""
+Benchmark history and regression checks. One bench run on a shared machine
+can easily be a few percent off, so a single number says little about
+whether a change made the search slower. This tool:
+
+- records bench results (see bench.py) in a history file, one JSON object per
+  line, so the numbers of earlier builds stay around to look back at;
+- compares two builds by running the bench on each of them in turns, A B B A
+  A B ..., so a machine that gets busier or cooler during the run affects
+  both builds alike, and reports the speedup of the new build with a 95%
+  confidence interval from a paired t-test on the log of the nps ratios;
+- exits with 1 when the new build is significantly slower, or when its node
+  count signature differs from the old one's without --signature-change to
+  say that the search was meant to change.
+
+A build is a directory holding the games package, or a git revision that is
+exported to a temporary directory with git archive.
+
+    python -m games.chess.regression compare BASE [NEW] [--trials N] [--depth D | --nodes N]
+    python -m games.chess.regression record [--json PATH] [--label L] [--depth D | --nodes N]
+    python -m games.chess.regression show [--last N]
+"""
+
+HISTORY = 'bench_history.jsonl'
+TRIALS = 5
+# Bench depth of a trial, lower than the bench default so that a comparison
+# of 2 x TRIALS runs takes a few minutes
+TRIAL_DEPTH = 4
+# Slowdowns smaller than this aren't reported as a regression even when they
+# are significant
+TOLERANCE = 0.01
+
+# Two-sided 95% quantiles of Student's t distribution for 1 to 30 degrees of
+# freedom, the normal one is close enough past that
+T95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+       2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+       2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+# This function returns the t quantile for a 95% interval
+def t95(df):
+    return T95[df - 1] if df <= len(T95) else 1.96
+
+
+# This function returns the mean speedup of new over old from paired samples,
+# and the low and high end of its 95% confidence interval
+def speedup(old, new):
+    ratios = [math.log(b / a) for a, b in zip(old, new)]
+    n = len(ratios)
+    mean = sum(ratios) / n
+    if n < 2:
+        return math.exp(mean), 0.0, float('inf')
+    sd = math.sqrt(sum((r - mean) ** 2 for r in ratios) / (n - 1))
+    margin = t95(n - 1) * sd / math.sqrt(n)
+    return math.exp(mean), math.exp(mean - margin), math.exp(mean + margin)
+
+
+# This function runs git in the current directory and returns its output
+def git(*args):
+    return subprocess.check_output(('git',) + args, stderr=subprocess.DEVNULL).decode().strip()
+
+
+# This function returns the directory of the games package of a build and a
+# label for it. A revision is exported into tmp, the directory it belongs in
+# within the repository is kept.
+def checkout(build, tmp):
+    if os.path.isdir(build):
+        return build, 'working-tree' if os.path.abspath(build) == os.getcwd() else build
+    label = git('rev-parse', '--short', build)
+    root, prefix = git('rev-parse', '--show-toplevel'), git('rev-parse', '--show-prefix')
+    archive = subprocess.check_output(['git', 'archive', '--format=tar', label], cwd=root)
+    directory = os.path.join(tmp, label)
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return os.path.join(directory, prefix), label
+
+
+# This function runs the bench of the build in directory in a new process and
+# returns its JSON results
+def run_bench(directory, bench_args):
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        process = subprocess.run([sys.executable, '-m', 'games.chess.bench', 'bench', '--json', path]
+                                 + bench_args, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if process.returncode:
+            raise RuntimeError('bench failed in {}:\n{}'.format(directory, process.stdout.decode()[-2000:]))
+        with open(path) as f:
+            return json.load(f)
+    finally:
+        os.remove(path)
+
+
+# This function appends a bench result to the history, without the per
+# position details
+def record(results, label, history=HISTORY):
+    entry = {
+        'label': label,
+        'time': results.get('time') or time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': results.get('python'),
+        'settings': results['settings'],
+        'total': results['total'],
+    }
+    with open(history, 'a') as f:
+        f.write(json.dumps(entry, sort_keys=True) + '\n')
+    return entry
+
+
+# This function returns the entries of the history file, oldest first
+def load_history(history=HISTORY):
+    if not os.path.exists(history):
+        return []
+    with open(history) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# This function returns the arguments that make the bench search like the
+# given command line options
+def bench_args(args):
+    bench = ['--backend', args.backend]
+    if args.nodes:
+        bench += ['--nodes', str(args.nodes)]
+    else:
+        bench += ['--depth', str(args.depth)]
+    return bench
+
+
+# Runs the bench on two builds in turns and returns True unless the new one
+# is significantly slower or searches differently
+def compare(base, new, trials=TRIALS, bench=(), history=HISTORY, signature_change=False, tolerance=TOLERANCE):
+    tmp = tempfile.mkdtemp(prefix='bench-')
+    try:
+        builds = [checkout(base, tmp), checkout(new, tmp)]
+        nps = [[], []]
+        signatures = [set(), set()]
+        for trial in range(trials):
+            # A B, then B A, so a trend in the machine's speed hits both alike
+            order = (0, 1) if trial % 2 == 0 else (1, 0)
+            for b in order:
+                directory, label = builds[b]
+                results = run_bench(directory, list(bench))
+                record(results, label, history)
+                nps[b].append(results['total']['nps'])
+                signatures[b].add(results['total']['nodes'])
+                print('trial {} {:<12} {:>9.0f} nps {:>9} nodes'.format(
+                    trial + 1, label, results['total']['nps'], results['total']['nodes']))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    ok = True
+    for (directory, label), signature in zip(builds, signatures):
+        if len(signature) > 1:
+            print('{} is not deterministic, its node counts were {}'.format(label, sorted(signature)))
+            ok = False
+    mean, low, high = speedup(*nps)
+    print('{} -> {}: {:.0f} -> {:.0f} nps, speedup {:.3f} (95% CI {:.3f} to {:.3f})'.format(
+        builds[0][1], builds[1][1], sum(nps[0]) / trials, sum(nps[1]) / trials, mean, low, high))
+    if high < 1.0 and mean < 1.0 - tolerance:
+        print('REGRESSION: the new build is significantly slower')
+        ok = False
+    elif low > 1.0:
+        print('The new build is significantly faster')
+    else:
+        print('No significant difference')
+    if signatures[0] != signatures[1]:
+        print('Node signature changed from {} to {}'.format(
+            ', '.join(map(str, sorted(signatures[0]))), ', '.join(map(str, sorted(signatures[1])))))
+        if not signature_change:
+            print('SIGNATURE CHANGE: pass --signature-change if the search was meant to change')
+            ok = False
+    return ok
+
+
+# Prints the last entries of the history, marking where the node signature
+# changed from the previous entry with the same settings
+def show(history=HISTORY, last=20):
+    entries = load_history(history)
+    previous = {}
+    lines = []
+    for entry in entries:
+        settings = json.dumps(entry['settings'], sort_keys=True)
+        nodes = entry['total']['nodes']
+        changed = settings in previous and previous[settings] != nodes
+        previous[settings] = nodes
+        lines.append('{} {:<12} {:>9.0f} nps {:>9} nodes{}'.format(
+            entry['time'], entry['label'], entry['total']['nps'], nodes, '  signature changed' if changed else ''))
+    for line in lines[-last:]:
+        print(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m games.chess.regression')
+    parser.add_argument('--history', default=HISTORY, help='file the results are kept in')
+    commands = parser.add_subparsers(dest='command')
+    run = commands.add_parser('compare', help='compare two builds with interleaved trials')
+    run.add_argument('base', help='directory or git revision of the old build')
+    run.add_argument('new', nargs='?', default='.', help='directory or git revision of the new build')
+    run.add_argument('--trials', type=int, default=TRIALS)
+    run.add_argument('--tolerance', type=float, default=TOLERANCE)
+    run.add_argument('--signature-change', action='store_true', help='the node counts are expected to change')
+    add = commands.add_parser('record', help='add a bench result to the history')
+    add.add_argument('--json', default=None, help='bench JSON to record instead of running the bench')
+    add.add_argument('--label', default=None, help='defaults to the current git revision')
+    for command in (run, add):
+        limit = command.add_mutually_exclusive_group()
+        limit.add_argument('--depth', type=int, default=TRIAL_DEPTH)
+        limit.add_argument('--nodes', type=int, default=None)
+        command.add_argument('--backend', default='mailbox')
+    view = commands.add_parser('show', help='print the history')
+    view.add_argument('--last', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        try:
+            return compare(args.base, args.new, args.trials, bench_args(args), args.history,
+                           args.signature_change, args.tolerance)
+        except (RuntimeError, subprocess.CalledProcessError) as e:
+            print(e)
+            return False
+    if args.command == 'record':
+        if args.json:
+            with open(args.json) as f:
+                results = json.load(f)
+        else:
+            results = run_bench('.', bench_args(args))
+        label = args.label
+        if label is None:
+            try:
+                label = git('rev-parse', '--short', 'HEAD')
+            except (OSError, subprocess.CalledProcessError):
+                label = 'unknown'
+        entry = record(results, label, args.history)
+        print('{} {:.0f} nps {} nodes'.format(label, entry['total']['nps'], entry['total']['nodes']))
+        return True
+    show(args.history, getattr(args, 'last', 20))
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(sys.argv[1:]) else 1)
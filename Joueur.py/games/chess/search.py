@@ -0,0 +1,439 @@
+import time
+from games.chess.transposition import (TranspositionTable, LOWER, UPPER, EXACT,
+                                       entry_depth, entry_flag, entry_move, entry_score)
+from games.chess.ordering import MoveOrdering
+from games.chess.state import piece_value
+from games.chess.bitbase import WIN, LOSS, DRAW
+
+"""
+An iterative deepening, depth limited principal variation search
+that runs on State objects, or on any other position backend with the same
+generate_legal_moves/generate_captures/move/null_move/unmove/in_check/
+check_check/has_non_pawn_material/evaluate/piece_on/see methods and a hash
+field, and men/piece_squares to probe endgame bitbases.
+move() returns the position to search next and unmove()
+restores the position it was called on, which does nothing for the immutable
+State but takes back the move on a mutable Position. The search always keeps
+the best move found so far so it can give an answer as soon as its time
+budget runs out. A move back to a position of the game or of the path from
+the root is scored as a draw by repetition.
+"""
+
+# Mate scores are MATE minus the ply the mate happens at
+MATE = 100000
+MATE_BOUND = MATE - 1000
+
+# Deepest iteration the search will ever try
+MAX_DEPTH = 64
+
+# Number of nodes searched between two looks at the clock. The search does
+# 7 to 35 thousand nodes a second, so this overshoots the deadline by at most
+# about 35 ms, less than the OVERHEAD the time manager keeps back.
+CHECK_EVERY = 256
+
+# A capture is skipped in the quiescence search if even winning its victim
+# and this much more can't bring the score up to alpha
+DELTA_MARGIN = 200
+# Most a pawn move onto an empty square can win, en passant or a promotion
+PROMOTION_GAIN = piece_value['Q'] - piece_value['P']
+# Most check evasions searched along one quiescence line, past them a
+# position in check is scored statically like any other
+QUIESCE_EVASIONS = 4
+
+# Null-move pruning: the null move is searched NULL_MOVE_R plies shallower,
+# and one more for every NULL_MOVE_DIVISOR plies of depth
+NULL_MOVE_MIN_DEPTH = 3
+NULL_MOVE_R = 2
+NULL_MOVE_DIVISOR = 4
+
+# Aspiration windows: from ASPIRATION_MIN_DEPTH on an iteration first searches
+# a window of ASPIRATION_WINDOW around the score of the one before, and the
+# side that fails is widened ASPIRATION_GROWTH times over until it holds
+ASPIRATION_MIN_DEPTH = 4
+ASPIRATION_WINDOW = 50
+ASPIRATION_GROWTH = 4
+
+# Late move reductions: quiet moves from the LMR_MIN_MOVES-th on are searched a
+# ply shallower at nodes at least LMR_MIN_DEPTH deep, and from the
+# LMR_MORE_MOVES-th on two plies shallower
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3
+LMR_MORE_MOVES = 8
+
+
+# Raised inside the search when the deadline has passed
+class SearchTimeout(Exception):
+    pass
+
+
+# Mate scores are stored in the transposition table relative to the node they
+# were found at, so they stay right when the position is reached at another ply
+def score_to_tt(score, ply):
+    if score >= MATE_BOUND: return score + ply
+    if score <= -MATE_BOUND: return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score >= MATE_BOUND: return score - ply
+    if score <= -MATE_BOUND: return score + ply
+    return score
+
+
+class Searcher:
+
+    def __init__(self, tt=None, null_move=True, lmr=True, bitbases=None):
+        self.tt = tt if tt is not None else TranspositionTable()
+        # Endgame tables that end the search in the positions they cover
+        self.bitbases = bitbases
+        self.ordering = MoveOrdering()
+        self.null_move = null_move
+        self.lmr = lmr
+        # Nodes searched by each iteration of the last search, and below each
+        # root move in the last iteration
+        self.iteration_nodes = []
+        # Seconds from the start of the last search to the end of each iteration
+        self.iteration_times = []
+        self.root_nodes = {}
+        self.nodes = 0
+        self.qnodes = 0
+        self.depth = 0
+        self.score = 0
+        self.best_move = None
+        self.deadline = None
+        self.max_nodes = None
+        # Nodes between two looks at the clock
+        self.check_every = CHECK_EVERY
+        # Hashes of the positions played in the game and on the path from the
+        # root to the node being searched
+        self.path = set()
+        # A Stats object counting what the search does, see stats.py
+        self.stats = None
+        # Anything with an is_set() method, stops the search once it is set
+        self.stop = None
+
+    # This function runs iterative deepening on the given state until either the
+    # time budget (in seconds) or max_depth is used up, and returns the best move.
+    # depth_offset starts it that many plies deeper, so the processes of a
+    # parallel search don't all search the same depth at the same time. A
+    # TimeManager given as timer decides after every iteration whether to go on.
+    # max_nodes stops the search after about that many nodes, at the same node
+    # every time, which a time budget can't do. history has the hashes of the
+    # positions played in the game before state, a move back to any of them
+    # is a draw by repetition. resume is the (depth, score, best move) of an
+    # earlier search of state, such as the ponder search, which is carried on
+    # from the next depth with that move first and the score as the centre of
+    # the aspiration window.
+    def search(self, state, time_budget, max_depth=MAX_DEPTH, depth_offset=0, timer=None, max_nodes=None,
+               history=(), resume=None):
+        self.nodes = 0
+        self.qnodes = 0
+        self.depth = 0
+        self.score = 0
+        start = time.perf_counter()
+        self.deadline = start + time_budget
+        self.max_nodes = max_nodes
+        self.iteration_nodes = []
+        self.iteration_times = []
+        self.path = set(history)
+        self.path.add(state.hash)
+        self.tt.new_search()
+        self.ordering.new_search()
+
+        root_moves = list(state.generate_legal_moves())
+        if not root_moves:
+            self.best_move = None
+            return None
+        root_moves = self.ordering.order(state, root_moves, entry_move(self.tt.probe(state.hash)))
+        self.best_move = root_moves[0]
+        first = 1 + depth_offset
+        if resume is not None and resume[2] in root_moves:
+            self.depth, self.score, self.best_move = resume
+            root_moves.remove(self.best_move)
+            root_moves.insert(0, self.best_move)
+            first = max(first, self.depth + 1)
+
+        for depth in range(first, max_depth + 1):
+            nodes = self.nodes
+            try:
+                self.score = self.aspiration(state, root_moves, depth)
+            except SearchTimeout:
+                break
+            self.depth = depth
+            self.iteration_nodes.append(self.nodes - nodes)
+            self.iteration_times.append(time.perf_counter() - start)
+            # Search the best move first in the next iteration and the others by
+            # the size of their subtrees in this one, a move that took many nodes
+            # to refute is the most likely to become best
+            root_moves.sort(key=lambda move: self.root_nodes.get(move, 0), reverse=True)
+            root_moves.remove(self.best_move)
+            root_moves.insert(0, self.best_move)
+            # A forced mate can't get any better by searching deeper
+            if abs(self.score) >= MATE_BOUND or len(root_moves) == 1:
+                break
+            if timer and not timer.next_iteration(self.best_move, self.score):
+                break
+        return self.best_move
+
+    # Frees what the searcher holds, nothing for a single process search
+    def close(self):
+        pass
+
+    # True once the deadline has passed, the node limit is reached or the
+    # search was told to stop
+    def out_of_time(self):
+        return (time.perf_counter() > self.deadline or (self.max_nodes is not None and self.nodes >= self.max_nodes)
+                or (self.stop is not None and self.stop.is_set()))
+
+    # The effective branching factor of the last search, how many times more
+    # nodes its last iteration took than the one before
+    def branching_factor(self):
+        if len(self.iteration_nodes) < 2 or not self.iteration_nodes[-2]:
+            return 0.0
+        return self.iteration_nodes[-1] / self.iteration_nodes[-2]
+
+    # This function runs one iteration inside an aspiration window around the
+    # score of the previous one. A result on the edge of the window is only a
+    # bound, so the window is widened on that side and the root searched again.
+    def aspiration(self, state, root_moves, depth):
+        if depth < ASPIRATION_MIN_DEPTH or abs(self.score) >= MATE_BOUND:
+            return self.search_root(state, root_moves, depth, -MATE, MATE)
+        delta = ASPIRATION_WINDOW
+        alpha, beta = max(self.score - delta, -MATE), min(self.score + delta, MATE)
+        while True:
+            score = self.search_root(state, root_moves, depth, alpha, beta)
+            delta *= ASPIRATION_GROWTH
+            if score <= alpha and alpha > -MATE:
+                alpha = max(alpha - delta, -MATE)
+            elif score >= beta and beta < MATE:
+                beta = min(beta + delta, MATE)
+                # the move that failed high is searched first next time
+                root_moves.remove(self.best_move)
+                root_moves.insert(0, self.best_move)
+            else:
+                return score
+
+    # This function searches every root move to the given depth, the first one
+    # with the full window and the others with a null window first (principal
+    # variation search). best_move is only replaced by a move whose subtree
+    # was searched completely, so it stays valid even if the deadline
+    # interrupts this iteration. root_nodes counts the nodes below each move.
+    def search_root(self, state, root_moves, depth, alpha, beta):
+        self.root_nodes = {}
+        path = self.path
+        for n, move in enumerate(root_moves):
+            nodes = self.nodes
+            child = state.move(move)
+            key = child.hash
+            repeated = key in path
+            path.add(key)
+            try:
+                if repeated:
+                    score = 0
+                elif n == 0:
+                    score = -self.alphabeta(child, depth - 1, -beta, -alpha, 1, move)
+                else:
+                    score = -self.alphabeta(child, depth - 1, -alpha - 1, -alpha, 1, move)
+                    if alpha < score < beta:
+                        score = -self.alphabeta(child, depth - 1, -beta, -alpha, 1, move)
+            finally:
+                # also when the deadline interrupts, so a Position is left as it was
+                if not repeated:
+                    path.discard(key)
+                state.unmove()
+            self.root_nodes[move] = self.nodes - nodes
+            if score >= beta:
+                self.best_move = move
+                return beta
+            if score > alpha:
+                alpha = score
+                self.best_move = move
+        return alpha
+
+    # This function returns the exact score of the position from the bitbases,
+    # a mate in the stored number of plies or a draw, or None if they don't
+    # cover it
+    def probe_bitbases(self, state, ply):
+        result = self.bitbases.probe(state)
+        if result is None:
+            return None
+        value, plies = result
+        if value == WIN:
+            return MATE - ply - plies
+        if value == LOSS:
+            return -(MATE - ply - plies)
+        return 0 if value == DRAW else None
+
+    # Fail-hard negamax search with alpha-beta pruning. The returned score is
+    # always clamped to [alpha, beta]. prev is the move that led to state, for
+    # the countermove table, or None after a null move.
+    def alphabeta(self, state, depth, alpha, beta, ply, prev=None):
+        if depth <= 0:
+            return self.quiesce(state, alpha, beta, ply)
+
+        self.nodes += 1
+        if self.nodes % self.check_every == 0 and self.out_of_time():
+            raise SearchTimeout()
+
+        if self.bitbases:
+            score = self.probe_bitbases(state, ply)
+            if score is not None:
+                return max(alpha, min(score, beta))
+
+        # Use the stored result if it was searched deep enough and its bound
+        # decides this window
+        tt = self.tt
+        data = tt.probe(state.hash)
+        hash_move = entry_move(data) if data else None
+        if data and entry_depth(data) >= depth:
+            score = score_from_tt(entry_score(data), ply)
+            flag = entry_flag(data)
+            if flag == EXACT or (flag == LOWER and score >= beta) or (flag == UPPER and score <= alpha):
+                if self.stats:
+                    self.stats.tt_cutoffs += 1
+                return max(alpha, min(score, beta))
+
+        in_check = state.in_check()
+        # Null-move pruning: if the opponent still can't get below beta after we
+        # pass, a real move would fail high too. Not in check, not twice in a
+        # row and not without pieces, where zugzwang makes passing the best move.
+        if (self.null_move and prev is not None and not in_check and depth >= NULL_MOVE_MIN_DEPTH
+                and abs(beta) < MATE_BOUND and state.has_non_pawn_material() and state.evaluate() >= beta):
+            reduction = NULL_MOVE_R + depth // NULL_MOVE_DIVISOR
+            try:
+                score = -self.alphabeta(state.null_move(), depth - 1 - reduction, -beta, -beta + 1, ply + 1, None)
+            finally:
+                state.unmove()
+            if self.stats:
+                self.stats.null_moves += 1
+            if score >= beta:
+                if self.stats:
+                    self.stats.null_cutoffs += 1
+                return beta
+
+        moves = list(state.generate_legal_moves())
+        best_move = None
+        path = self.path
+        for n, move in enumerate(self.ordering.order(state, moves, hash_move, ply, prev)):
+            # piece moves that capture nothing, pawn moves are never reduced
+            quiet = state.piece_on(move[1]) == '.' and state.piece_on(move[0]) != 'P'
+            child = state.move(move)
+            # a position already played or on the path here is a draw
+            key = child.hash
+            repeated = key in path
+            path.add(key)
+            try:
+                if repeated:
+                    score = 0
+                elif n == 0:
+                    score = -self.alphabeta(child, depth - 1, -beta, -alpha, ply + 1, move)
+                else:
+                    # Late move reduction: a quiet move this far down the
+                    # ordering rarely raises alpha, so it is searched shallower
+                    # first and to full depth only if it does raise alpha
+                    reduction = 0
+                    if (self.lmr and quiet and n >= LMR_MIN_MOVES and depth >= LMR_MIN_DEPTH
+                            and not in_check and not child.in_check()):
+                        reduction = 1 if n < LMR_MORE_MOVES else 2
+                        score = -self.alphabeta(child, depth - 1 - reduction, -alpha - 1, -alpha, ply + 1, move)
+                    # Principal variation search: after the first move every
+                    # move only has to be shown not to beat alpha, which a null
+                    # window does cheapest, and gets the full window if it does
+                    if not reduction or score > alpha:
+                        score = -self.alphabeta(child, depth - 1, -alpha - 1, -alpha, ply + 1, move)
+                        if alpha < score < beta:
+                            score = -self.alphabeta(child, depth - 1, -beta, -alpha, ply + 1, move)
+            finally:
+                if not repeated:
+                    path.discard(key)
+                state.unmove()
+            if score >= beta:
+                self.ordering.cutoff(state, move, n, depth, ply, prev)
+                tt.store(state.hash, move, score_to_tt(beta, ply), depth, LOWER)
+                return beta
+            if score > alpha:
+                alpha = score
+                best_move = move
+
+        if not moves:
+            # Checkmate if we are in check, else stalemate
+            score = -(MATE - ply) if in_check else 0
+            tt.store(state.hash, None, score_to_tt(score, ply), depth, EXACT)
+            return max(alpha, min(score, beta))
+        tt.store(state.hash, best_move, score_to_tt(alpha, ply), depth,
+                 EXACT if best_move else UPPER)
+        return alpha
+
+    # Quiescence search. Past the horizon only captures and promotions are
+    # played out, so the static evaluation is only ever taken in a quiet
+    # position. The side to move may stand pat on the static evaluation
+    # instead of capturing unless it is in check, captures that can't raise
+    # the score to alpha are delta pruned and captures that lose material by
+    # SEE are skipped. evasions counts the check evasions searched on the way
+    # here.
+    def quiesce(self, state, alpha, beta, ply, evasions=0):
+        self.nodes += 1
+        self.qnodes += 1
+        if self.nodes % self.check_every == 0 and self.out_of_time():
+            raise SearchTimeout()
+
+        if self.bitbases:
+            score = self.probe_bitbases(state, ply)
+            if score is not None:
+                return max(alpha, min(score, beta))
+
+        # In check there is no standing pat, the position may be lost, so every
+        # evasion is searched. An evasion can give check itself and lead here
+        # again, so only QUIESCE_EVASIONS of them are searched along a line.
+        if evasions < QUIESCE_EVASIONS and state.in_check():
+            moves = list(state.generate_legal_moves())
+            if not moves:
+                return max(alpha, min(-(MATE - ply), beta))
+            for move in self.ordering.order(state, moves, None, ply):
+                try:
+                    score = -self.quiesce(state.move(move), -beta, -alpha, ply + 1, evasions + 1)
+                finally:
+                    state.unmove()
+                if score >= beta:
+                    return beta
+                if score > alpha:
+                    alpha = score
+            return alpha
+
+        stand_pat = state.evaluate()
+        if stand_pat >= beta:
+            return beta
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        captures = []
+        for move in state.generate_captures():
+            victim, attacker = state.piece_on(move[1]), state.piece_on(move[0])
+            gain = piece_value[victim] if victim != '.' else PROMOTION_GAIN
+            # a capture that promotes wins the queen as well
+            if attacker == 'P' and victim != '.' and state.promotes(move):
+                gain += PROMOTION_GAIN
+            if stand_pat + gain + DELTA_MARGIN <= alpha:
+                continue
+            # a capture by a more valuable piece may lose it to a recapture
+            if piece_value[attacker] > gain and state.see(move) < 0:
+                continue
+            # most valuable victim first, then least valuable attacker
+            captures.append((gain, -piece_value[attacker], move))
+        captures.sort(reverse=True)
+
+        for gain, attacker, move in captures:
+            child = state.move(move)
+            try:
+                # generate_captures is pseudo-legal, so leaving our king in
+                # check has to be caught here
+                if child.check_check():
+                    continue
+                score = -self.quiesce(child, -beta, -alpha, ply + 1, evasions)
+            finally:
+                state.unmove()
+            if score >= beta:
+                return beta
+            if score > alpha:
+                alpha = score
+        return alpha
@@ -0,0 +1,117 @@
+import multiprocessing
+import pickle
+import queue
+import time
+
+from games.chess.search import Searcher, MAX_DEPTH, CHECK_EVERY
+from games.chess.timeman import OVERHEAD
+from games.chess.transposition import SharedTranspositionTable
+
+"""
+Lazy SMP: a parallel search where every process searches the same root on
+its own and the only thing they share is the transposition table. A helper
+that gets to a position first leaves its result in the table, so the others
+get cutoffs there instead of searching it again, and their different timing
+spreads them over different parts of the tree. Every other helper searches
+one ply deeper than the main search so they don't all finish the same depth
+at the same time.
+
+CPython threads can't search in parallel because of the GIL, so the helpers
+are processes and the table lives in shared memory. A table slot is written
+without a lock, the XOR of key and data in SharedTranspositionTable catches
+a slot that was read half written.
+"""
+
+# Most seconds to wait for a helper's result after the search is stopped, it
+# is never waited for past OVERHEAD before the search's deadline
+HELPER_TIMEOUT = 1.0
+
+
+# The loop of a helper process: search every job it gets until the main
+# search sets stop, then send back what it found
+def helper(tt, jobs, results, stop, null_move, lmr, bitbases, depth_offset):
+    searcher = Searcher(tt, null_move, lmr, bitbases)
+    searcher.stop = stop
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, state, time_budget, max_depth, history = pickle.loads(job)
+        searcher.search(state, time_budget, max_depth, depth_offset, history=history)
+        results.put((job_id, searcher.depth, searcher.score, searcher.best_move,
+                     searcher.nodes, searcher.qnodes))
+
+
+# A Searcher that searches with threads - 1 helper processes besides itself
+# and returns the result of whichever got the deepest
+class ParallelSearcher(Searcher):
+
+    def __init__(self, threads, size_mb=16, null_move=True, lmr=True, bitbases=None):
+        Searcher.__init__(self, SharedTranspositionTable(size_mb), null_move, lmr, bitbases)
+        # The helpers take CPU from this process where there are fewer cores
+        # than processes, so its nodes come slower and the clock is looked at
+        # that much more often
+        self.check_every = max(1, CHECK_EVERY // threads)
+        self.helper_stop = multiprocessing.Event()
+        self.results = multiprocessing.Queue()
+        self.jobs = []
+        self.helpers = []
+        self.job = 0
+        for k in range(1, threads):
+            jobs = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=helper, args=(self.tt, jobs, self.results, self.helper_stop, null_move, lmr, bitbases, k % 2))
+            process.daemon = True
+            process.start()
+            self.jobs.append(jobs)
+            self.helpers.append(process)
+
+    def search(self, state, time_budget, max_depth=MAX_DEPTH, depth_offset=0, timer=None, max_nodes=None,
+               history=(), resume=None):
+        self.job += 1
+        self.helper_stop.clear()
+        # A queue pickles in a thread of its own, by which time a mutable
+        # Position is already being searched here, so it's pickled right now
+        job = pickle.dumps((self.job, state, time_budget, max_depth, tuple(history)))
+        for jobs in self.jobs:
+            jobs.put(job)
+        try:
+            # a node limit only counts the nodes of this process, the helpers
+            # are stopped with it
+            Searcher.search(self, state, time_budget, max_depth, depth_offset, timer, max_nodes, history, resume)
+        finally:
+            self.helper_stop.set()
+
+        # The helpers stop within moments, but the clock is running: results
+        # are only waited for until OVERHEAD before the deadline, after that
+        # only the ones already in are taken, and without any this process's
+        # move is played
+        pending = len(self.helpers)
+        while pending:
+            timeout = min(HELPER_TIMEOUT, self.deadline - OVERHEAD - time.perf_counter())
+            try:
+                if timeout > 0:
+                    result = self.results.get(timeout=timeout)
+                else:
+                    result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            job, depth, score, best_move, nodes, qnodes = result
+            # a late answer to an earlier search
+            if job != self.job:
+                continue
+            pending -= 1
+            self.nodes += nodes
+            self.qnodes += qnodes
+            if best_move is not None and depth > self.depth:
+                self.depth, self.score, self.best_move = depth, score, best_move
+        return self.best_move
+
+    # Ends the helper processes and frees the shared table
+    def close(self):
+        self.helper_stop.set()
+        for jobs in self.jobs:
+            jobs.put(None)
+        for process in self.helpers:
+            process.join(HELPER_TIMEOUT)
+        self.tt.close()
@@ -1,5 +1,7 @@
 from collections import namedtuple
-from itertools import count
+import random
+from games.chess.helper import move_to_uci
+from games.chess.pst import pst, taper, PHASE
 
 """ 
 A state class that interprets the given fen in the form of a board
@@ -22,47 +24,311 @@ dir = {
     'K': (N, E, S, W, N + E, S + E, S + W, N + W)
 }
 
-class State(namedtuple('State', 'board score wc bc ep kp depth captured')):
+# Slider directions
+ORTHOGONAL = (N, E, S, W)
+DIAGONAL = (N + E, S + E, S + W, N + W)
+
+# The 64 playable squares of the 10x12 board
+SQUARES = [i for i in range(A8, H1 + 1) if 1 <= i % 10 <= 8]
+# SQUARE_INDEX[i] is the position of mailbox square i in SQUARES, 0 for a8 to
+# 63 for h1
+SQUARE_INDEX = [None] * 120
+for n, i in enumerate(SQUARES):
+    SQUARE_INDEX[i] = n
+
+# Attack patterns, built once for every playable square: the knight and king
+# squares around it, and the squares along each orthogonal and diagonal ray up
+# to the edge of the board
+knight_squares = [()] * 120
+king_squares = [()] * 120
+orthogonal_rays = [()] * 120
+diagonal_rays = [()] * 120
+
+
+# This function returns the playable squares from i along direction d
+def _ray(i, d):
+    squares = []
+    j = i + d
+    while j in SQUARES:
+        squares.append(j)
+        j += d
+    return tuple(squares)
+
+
+for i in SQUARES:
+    knight_squares[i] = tuple(i + d for d in dir['N'] if i + d in SQUARES)
+    king_squares[i] = tuple(i + d for d in dir['K'] if i + d in SQUARES)
+    orthogonal_rays[i] = tuple(r for r in (_ray(i, d) for d in ORTHOGONAL) if r)
+    diagonal_rays[i] = tuple(r for r in (_ray(i, d) for d in DIAGONAL) if r)
+
+# Move tables for the same squares. A piece slides along each ray of
+# piece_rays[p][i] until it is blocked, knights and kings get rays of a single
+# square. A pawn moves to the squares of pawn_pushes[i] in order (two of them
+# on its second rank) and captures onto pawn_captures[i].
+piece_rays = {p: [()] * 120 for p in 'NBRQK'}
+pawn_pushes = [()] * 120
+pawn_captures = [()] * 120
+for i in SQUARES:
+    for p in 'BRQ':
+        piece_rays[p][i] = tuple(r for r in (_ray(i, d) for d in dir[p]) if r)
+    for p in 'NK':
+        piece_rays[p][i] = tuple((j,) for j in (i + d for d in dir[p]) if j in SQUARES)
+    pawn_pushes[i] = tuple(j for j in ((i + N, i + N + N) if i >= A1 + N else (i + N,)) if j in SQUARES)
+    pawn_captures[i] = tuple(j for j in (i + N + W, i + N + E) if j in SQUARES)
+
+# Side arguments of is_square_attacked: the side to move (uppercase) or the
+# opponent (lowercase)
+US, THEM = True, False
+# Pieces of each side that attack a square, as (knight, king, pawn, rook or
+# queen, bishop or queen, offsets from sq to a pawn that attacks it)
+attackers = {
+    US: ('N', 'K', 'P', 'RQ', 'BQ', (S + W, S + E)),
+    THEM: ('n', 'k', 'p', 'rq', 'bq', (N + W, N + E)),
+}
+
+
+# This function checks if any piece of the given side attacks square sq. It
+# looks outward from sq along the knight, king, pawn and ray patterns instead
+# of generating the moves of the attacking side.
+def square_attacked(board, sq, by_side):
+    knight, king, pawn, rook, bishop, pawn_from = attackers[by_side]
+    if board[sq + pawn_from[0]] == pawn or board[sq + pawn_from[1]] == pawn: return True
+    for j in knight_squares[sq]:
+        if board[j] == knight: return True
+    for j in king_squares[sq]:
+        if board[j] == king: return True
+    for ray in orthogonal_rays[sq]:
+        for j in ray:
+            q = board[j]
+            if q != '.':
+                if q in rook: return True
+                break
+    for ray in diagonal_rays[sq]:
+        for j in ray:
+            q = board[j]
+            if q != '.':
+                if q in bishop: return True
+                break
+    return False
+
+
+# Plain material value of each piece, for weighing captures against each other
+piece_value = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+# Penalty for every square next to a king that the other side attacks
+KING_ZONE_ATTACK = 8
+# Values for the static exchange evaluation, where the king may only capture last
+see_value = dict(piece_value, K=20000)
+
+
+# This function returns the square of the least valuable piece of the given
+# side (US is uppercase) that attacks sq, or 0 if there is none
+def least_attacker(board, sq, by_side):
+    knight, king, pawn, rook, bishop, pawn_from = attackers[by_side]
+    for d in pawn_from:
+        if board[sq + d] == pawn: return sq + d
+    for j in knight_squares[sq]:
+        if board[j] == knight: return j
+    # the first piece along every ray, bishops before rooks before queens
+    found = {}
+    for rays, sliders in ((diagonal_rays[sq], bishop), (orthogonal_rays[sq], rook)):
+        for ray in rays:
+            for j in ray:
+                q = board[j]
+                if q != '.':
+                    if q in sliders: found.setdefault(q, j)
+                    break
+    for q in (bishop[0], rook[0], rook[1]):
+        if q in found: return found[q]
+    for j in king_squares[sq]:
+        if board[j] == king: return j
+    return 0
+
+
+# Static exchange evaluation: the material the side to move (uppercase) wins
+# by playing the capture and then letting both sides recapture on the target
+# square with their least valuable piece for as long as that pays off. Pieces
+# that come off the board uncover the sliders behind them.
+def see(board, move):
+    i, j = move[0], move[1]
+    board = list(board)
+    gain = [see_value[board[j].upper()] if board[j] != '.' else 0]
+    piece = board[i].upper()
+    board[i] = '.'
+    side = THEM
+    while True:
+        a = least_attacker(board, j, side)
+        if not a:
+            break
+        # what the side capturing now wins if the exchange stops after it
+        gain.append(see_value[piece] - gain[-1])
+        piece = board[a].upper()
+        board[a] = '.'
+        side = not side
+    # either side may stop recapturing when that is better for it
+    for n in range(len(gain) - 1, 0, -1):
+        gain[n - 1] = -max(-gain[n - 1], gain[n])
+    return gain[0]
+
+# Zobrist keys. A State is always seen from the side to move, so every key for
+# a piece on a square is paired with the key for the opposite colored piece on
+# the mirrored square (119 - i), which holds the same key with its 32-bit halves
+# swapped. Rotating the board then only swaps the halves of the hash, while the
+# same placement with the other side to move still gets a different key.
+MASK64 = (1 << 64) - 1
+
+
+# Swaps the upper and lower 32 bits of a 64 bit key
+def swap_halves(key):
+    return (key >> 32) | ((key << 32) & MASK64)
+
+
+# Fixed seed so hashes are the same in every run
+_rng = random.Random(0x5EED)
+zobrist = {p: [0] * 120 for p in 'PNBRQKpnbrqk.'}
+for p in 'PNBRQK':
+    for i in range(120):
+        zobrist[p][i] = _rng.getrandbits(64)
+        zobrist[p.lower()][119 - i] = swap_halves(zobrist[p][i])
+zobrist_ep = [0] * 120
+for i in range(60):
+    zobrist_ep[i] = _rng.getrandbits(64)
+    zobrist_ep[119 - i] = swap_halves(zobrist_ep[i])
+zobrist_ep[0] = zobrist_ep[119] = 0  # ep == 0 means no en passant square
+# Keys for our (wc) and the opponent's (bc) A1 and H1 side castling rights
+zobrist_wc = (_rng.getrandbits(64), _rng.getrandbits(64))
+zobrist_bc = (swap_halves(zobrist_wc[0]), swap_halves(zobrist_wc[1]))
+
+
+# This function returns the key of the castling rights wc and bc
+def castling_hash(wc, bc):
+    h = 0
+    if wc[0]: h ^= zobrist_wc[0]
+    if wc[1]: h ^= zobrist_wc[1]
+    if bc[0]: h ^= zobrist_bc[0]
+    if bc[1]: h ^= zobrist_bc[1]
+    return h
+
+
+# This function computes the Zobrist key of a position from scratch
+def zobrist_hash(board, wc, bc, ep):
+    h = castling_hash(wc, bc) ^ zobrist_ep[ep]
+    for i, p in enumerate(board):
+        if p in 'PNBRQKpnbrqk':
+            h ^= zobrist[p][i]
+    return h
+
+
+# Piece lists. State.pieces holds the squares of every piece type, ours first
+# then the opponent's, in the order of PIECES, so generating moves and scoring
+# only ever touch occupied squares. move() updates the few lists a move changes
+# and rotate() swaps the two halves and mirrors their squares.
+PIECES = 'PNBRQKpnbrqk'
+PIECE_INDEX = {p: n for n, p in enumerate(PIECES)}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+# A move is (from, to), which promotes a pawn to a queen, or (from, to, piece)
+# for a promotion to one of these
+UNDERPROMOTIONS = ('N', 'B', 'R')
+# mirror(i) is 119 - i, the square i ends up on when the board is rotated
+mirror = tuple(119 - i for i in range(120)).__getitem__
+
+
+# This function adds up the piece-square score of a board from scratch, the
+# score move() keeps up to date in State.score
+def board_score(board):
+    return sum(pst[p][i] for i, p in enumerate(board) if p in pst)
+
+
+# This function returns the game phase of the piece lists, see pst.taper
+def game_phase(pieces):
+    return (len(pieces[KNIGHT]) + len(pieces[KNIGHT + 6]) + len(pieces[BISHOP]) + len(pieces[BISHOP + 6])
+            + PHASE['R'] * (len(pieces[ROOK]) + len(pieces[ROOK + 6]))
+            + PHASE['Q'] * (len(pieces[QUEEN]) + len(pieces[QUEEN + 6])))
+
+
+# This function builds the piece lists of a board from scratch
+def piece_lists(board):
+    pieces = [[] for _ in PIECES]
+    for i, p in enumerate(board):
+        if p in PIECE_INDEX:
+            pieces[PIECE_INDEX[p]].append(i)
+    return tuple(tuple(group) for group in pieces)
+
+
+class State(namedtuple('State', 'board score wc bc ep kp depth captured hash pieces')):
 
     # Generates all possible moves for a given state
     def generate_moves(self):
-        for i, p in enumerate(self.board):
-            # i - initial State index
-            # p - piece 
-
-            # if the piece doesn't belong to us, skip it
-            if not p.isupper(): continue
-            for d in dir[p]:
-                # d - Potential move direction for a piece p
-                for j in count(i + d, d):
-                    # j - final State index
-                    # q - occupying piece code
-                    q = self.board[j]
-                    if q.isspace() or q.isupper(): break
-                    # Pawn move, double move and capture
-                    if p == 'P' and d in (N, N + N) and q != '.': break
-                    if p == 'P' and d == N + N and (i < A1 + N or self.board[i + N] != '.'): break
-                    if p == 'P' and d in (N + W, N + E) and q == '.' and j not in (self.ep, self.kp): break
-                    # Move it
+        board, pieces = self.board, self.pieces
+        # i - initial State index
+        # Pawn move and double move, blocked by any piece
+        for i in pieces[PAWN]:
+            for j in pawn_pushes[i]:
+                if board[j] != '.': break
+                yield (i, j)
+                # a pawn reaching the last rank may also become a knight, bishop or rook
+                if j <= H8:
+                    for promotion in UNDERPROMOTIONS: yield (i, j, promotion)
+            # Pawn capture, also onto the en passant or castling king square
+            for j in pawn_captures[i]:
+                q = board[j]
+                if q.islower() or (q == '.' and j in (self.ep, self.kp)):
                     yield (i, j)
-                    # Stop non-sliders from sliding and sliding after captures
-                    if p in 'PNK' or q.islower(): break
-                    # Castling by sliding rook next to king
-                    if i == A1 and self.board[j + E] == 'K' and self.wc[0]: yield (j + E, j + W)
-                    if i == H1 and self.board[j + W] == 'K' and self.wc[1]: yield (j + W, j + E)
+                    if j <= H8:
+                        for promotion in UNDERPROMOTIONS: yield (i, j, promotion)
+        for p, group in zip('NBRQK', pieces[KNIGHT:KING + 1]):
+            for i in group:
+                for ray in piece_rays[p][i]:
+                    for j in ray:
+                        # j - final State index
+                        # q - occupying piece code
+                        q = board[j]
+                        if q.isupper(): break
+                        # Move it
+                        yield (i, j)
+                        # Stop sliding after captures
+                        if q != '.': break
+                        # Castling by sliding rook next to king
+                        if i == A1 and board[j + E] == 'K' and self.wc[0]: yield (j + E, j + W)
+                        if i == H1 and board[j + W] == 'K' and self.wc[1]: yield (j + W, j + E)
+
+    # Generates the pseudo-legal captures and promotions, the moves the
+    # quiescence search plays out
+    def generate_captures(self):
+        board, pieces = self.board, self.pieces
+        for i in pieces[PAWN]:
+            for j in pawn_captures[i]:
+                q = board[j]
+                if q.islower() or (q == '.' and j == self.ep): yield (i, j)
+            # promotion by a push
+            if i <= H8 - N and board[i + N] == '.': yield (i, i + N)
+        for p, group in zip('NBRQK', pieces[KNIGHT:KING + 1]):
+            for i in group:
+                for ray in piece_rays[p][i]:
+                    for j in ray:
+                        q = board[j]
+                        if q == '.': continue
+                        if q.islower(): yield (i, j)
+                        break
+
+    # This function returns the static exchange evaluation of a capture, see see()
+    def see(self, move):
+        return see(self.board, move)
 
     # This function rotates the board by preserving enpassant, so that it's ready for the next player.
     def rotate(self):
         return State(
             self.board[::-1].swapcase(), -self.score, self.bc, self.wc,
             119 - self.ep if self.ep else 0,
-            119 - self.kp if self.kp else 0, self.depth, None)
+            119 - self.kp if self.kp else 0, self.depth, self.captured,
+            swap_halves(self.hash),
+            tuple([tuple(map(mirror, group)) if group else group
+                   for group in self.pieces[6:] + self.pieces[:6]]))
 
     # This function computes a move and returns a State object that represents the state after that move
     def move(self, move):
         # i - initial State index
         # j - final State index
-        i, j = move
+        i, j = move[0], move[1]
         # p - piece code of moving piece
         # q - piece code at final square
         p, q = self.board[i], self.board[j]
@@ -71,10 +337,21 @@ class State(namedtuple('State', 'board score wc bc ep kp depth captured')):
         # copy variables and reset eq and kp and increment depth
         board = self.board
         wc, bc, ep, kp, depth = self.wc, self.bc, 0, 0, self.depth + 1
-        # score = self.score + self.value(move)
+        # move the piece on the piece-square tables and drop a captured piece
+        score = self.score + pst[p][j] - pst[p][i] - pst[q][j]
+        # take the old castling rights and en passant square out of the hash
+        h = self.hash ^ castling_hash(wc, bc) ^ zobrist_ep[self.ep]
         # perform the move
         board = put(board, j, board[i])
         board = put(board, i, '.')
+        h ^= zobrist[p][i] ^ zobrist[p][j] ^ zobrist[q][j]
+        # move the piece in its list and take a captured piece off its list
+        pieces = list(self.pieces)
+        n = PIECE_INDEX[p]
+        pieces[n] = tuple(j if k == i else k for k in pieces[n])
+        if q.islower():
+            n = PIECE_INDEX[q]
+            pieces[n] = tuple(k for k in pieces[n] if k != j)
         # update castling rights, if we move our rook or capture the opponent's rook
         if i == A1: wc = (False, wc[1])
         if i == H1: wc = (wc[0], False)
@@ -87,24 +364,193 @@ class State(namedtuple('State', 'board score wc bc ep kp depth captured')):
                 kp = (i + j) // 2
                 board = put(board, A1 if j < i else H1, '.')
                 board = put(board, kp, 'R')
+                h ^= zobrist['R'][A1 if j < i else H1] ^ zobrist['R'][kp]
+                score += pst['R'][kp] - pst['R'][A1 if j < i else H1]
+                pieces[ROOK] = tuple(kp if k == (A1 if j < i else H1) else k for k in pieces[ROOK])
         # Pawn promotion, double move, and en passant capture
         if p == 'P':
             if A8 <= j <= H8:
-                # Promote the pawn to Queen
-                board = put(board, j, 'Q')
+                # Promote the pawn to Queen unless the move names another piece
+                promotion = move[2] if len(move) > 2 else 'Q'
+                board = put(board, j, promotion)
+                h ^= zobrist['P'][j] ^ zobrist[promotion][j]
+                score += pst[promotion][j] - pst['P'][j]
+                pieces[PAWN] = tuple(k for k in pieces[PAWN] if k != j)
+                pieces[PIECE_INDEX[promotion]] += (j,)
             if j - i == 2 * N:
                 ep = i + N
             if j - i in (N + W, N + E) and q == '.':
                 board = put(board, j + S, '.')
+                h ^= zobrist['p'][j + S]
+                score -= pst['p'][j + S]
+                pieces[PAWN + 6] = tuple(k for k in pieces[PAWN + 6] if k != j + S)
+        # put the new castling rights and en passant square back into the hash
+        h ^= castling_hash(wc, bc) ^ zobrist_ep[ep]
         # Rotate the returned State so it's ready for the next player
-        return State(board, 0, wc, bc, ep, kp, depth, q.upper()).rotate()
+        return State(board, score, wc, bc, ep, kp, depth, q.upper(), h, tuple(pieces)).rotate()
+
+    # Generates only the legal moves. The checking pieces and the pinned pieces
+    # are found once by looking outward from our king, then a pinned piece may
+    # only move along its pin, a check has to be answered by a king move, a
+    # capture of the checker or a block, and in double check only the king moves.
+    def generate_legal_moves(self):
+        board = self.board
+        k = board.find('K')
+        if k < 0:
+            return
+
+        # pinned maps a pinned square to the squares of its pin line, checks are
+        # the squares that capture a checker or block its line
+        pinned, checkers, checks = {}, 0, set()
+        for rays, sliders in ((orthogonal_rays[k], 'rq'), (diagonal_rays[k], 'bq')):
+            for ray in rays:
+                ours = 0
+                for n, j in enumerate(ray):
+                    q = board[j]
+                    if q == '.': continue
+                    if q.isupper() and not ours:
+                        ours = j
+                        continue
+                    if q in sliders:
+                        if ours:
+                            pinned[ours] = ray[:n + 1]
+                        else:
+                            checkers += 1
+                            checks.update(ray[:n + 1])
+                    break
+        for j in knight_squares[k]:
+            if board[j] == 'n':
+                checkers += 1
+                checks.add(j)
+        for j in pawn_captures[k]:
+            if board[j] == 'p':
+                checkers += 1
+                checks.add(j)
+
+        # The king may go to any square the opponent doesn't attack once the king
+        # is off its square, so a checking slider also covers the squares behind it
+        empty = board[:k] + '.' + board[k + 1:]
+        for d in dir['K']:
+            q = board[k + d]
+            if (q == '.' or q.islower()) and not square_attacked(empty, k + d, THEM):
+                yield (k, k + d)
+        if checkers > 1:
+            return
+
+        # Castling, not out of, through or into check
+        if not checkers:
+            if self.wc[0] and board[A1] == 'R' and board[A1 + 1:k] == '.' * (k - A1 - 1) \
+                    and not square_attacked(board, k - 1, THEM) and not square_attacked(board, k - 2, THEM):
+                yield (k, k - 2)
+            if self.wc[1] and board[H1] == 'R' and board[k + 1:H1] == '.' * (H1 - k - 1) \
+                    and not square_attacked(board, k + 1, THEM) and not square_attacked(board, k + 2, THEM):
+                yield (k, k + 2)
+
+        # a pinned piece can only move along the line of its pin
+        for i in self.pieces[PAWN]:
+            pin = pinned.get(i)
+            for j in pawn_pushes[i]:
+                if board[j] != '.': break
+                if (not checkers or j in checks) and (not pin or j in pin):
+                    yield (i, j)
+                    if j <= H8:
+                        for promotion in UNDERPROMOTIONS: yield (i, j, promotion)
+            for j in pawn_captures[i]:
+                if pin and j not in pin: continue
+                q = board[j]
+                if q.islower():
+                    if not checkers or j in checks:
+                        yield (i, j)
+                        if j <= H8:
+                            for promotion in UNDERPROMOTIONS: yield (i, j, promotion)
+                # en passant can uncover a check along the rank, so it is
+                # simply played and looked at
+                elif j == self.ep and not self.move((i, j)).check_check():
+                    yield (i, j)
+        for p, group in zip('NBRQ', self.pieces[KNIGHT:KING]):
+            for i in group:
+                pin = pinned.get(i)
+                for ray in piece_rays[p][i]:
+                    if pin and ray[0] not in pin: continue
+                    for j in ray:
+                        q = board[j]
+                        if q.isupper(): break
+                        if not checkers or j in checks: yield (i, j)
+                        if q != '.': break
+
+    # This function passes the turn without moving, for null-move pruning. The
+    # en passant and castling king squares only last for one move, so they go.
+    def null_move(self):
+        return State(self.board, self.score, self.wc, self.bc, 0, 0, self.depth + 1, None,
+                     self.hash ^ zobrist_ep[self.ep], self.pieces).rotate()
+
+    # This function checks if the side to move has a piece other than pawns and
+    # the king, without which passing the turn is often the best move
+    def has_non_pawn_material(self):
+        pieces = self.pieces
+        return bool(pieces[KNIGHT] or pieces[BISHOP] or pieces[ROOK] or pieces[QUEEN])
+
+    # The number of pieces on the board, kings included
+    def men(self):
+        return sum(map(len, self.pieces))
+
+    # This function returns (piece, square) for every piece on the board as the
+    # side to move sees it: its pieces are uppercase and squares are numbered
+    # by SQUARE_INDEX on a board where it plays up, as on the board of a State
+    def piece_squares(self):
+        return [(PIECES[k], SQUARE_INDEX[i]) for k, squares in enumerate(self.pieces) for i in squares]
+
+    # State is immutable, so there is nothing to take back after move(). This
+    # lets the search drive a State and a mutable Position through the same calls.
+    def unmove(self):
+        pass
+
+    # This function returns the uppercase letter of the piece on the square, of
+    # either side, or '.' if it is empty
+    def piece_on(self, square):
+        return self.board[square].upper()
 
-    # This function checks if the any of the valid moves for given board state ends in a check 
+    # This function checks if a move is a pawn reaching the last rank
+    def promotes(self, move):
+        return self.board[move[0]] == 'P' and A8 <= move[1] <= H8
+
+    # This function checks if a piece of by_side (US for the side to move, THEM
+    # for the opponent) attacks the square
+    def is_square_attacked(self, square, by_side):
+        return square_attacked(self.board, square, by_side)
+
+    # This function checks if the side to move is in check
+    def in_check(self):
+        k = self.board.find('K')
+        return k >= 0 and square_attacked(self.board, k, THEM)
+
+    # This function checks if the side to move can capture the opponent's king,
+    # which means the move that led here was illegal
     def check_check(self):
-        for move in self.generate_moves():
-            i, j = move
-            p, q = self.board[i], self.board[j]
-            # opponent can take our king
-            if q == 'k':
-                return True
-        return False
+        k = self.board.find('k')
+        return k >= 0 and square_attacked(self.board, k, US)
+
+    # This function returns a penalty for every square next to the king of the
+    # side to move that the opponent attacks, minus the same for the opponent's king
+    def king_safety(self):
+        board = self.board
+        score = 0
+        k = board.find('K')
+        if k >= 0:
+            for j in king_squares[k]:
+                if square_attacked(board, j, THEM): score -= KING_ZONE_ATTACK
+        k = board.find('k')
+        if k >= 0:
+            for j in king_squares[k]:
+                if square_attacked(board, j, US): score += KING_ZONE_ATTACK
+        return score
+
+    # This function scores the board from the point of view of the side to move:
+    # the incrementally updated material and piece-square score, tapered by the
+    # game phase, plus king safety
+    def evaluate(self):
+        return taper(self.score, game_phase(self.pieces)) + self.king_safety()
+
+    # Converts a move into UCI notation, color is the side to move of this State
+    def to_uci(self, move, color):
+        return move_to_uci(self, move, color)
@@ -0,0 +1,176 @@
+import inspect
+import json
+import time
+
+from games.chess.ordering import CUTOFF_SLOTS
+
+"""
+Search statistics, switched on with --aiSettings stats=1. They show where the
+time of a move goes: a line per move with the node counts, how often the
+transposition table had the position and cut the search off, which move of
+a node failed high, how often the null move did, and the seconds spent in
+move generation, legality checks, evaluation and making moves, and in the
+round trip to the server after the move was sent. The totals over the game
+are written to a file when it ends.
+
+When stats are off nothing here is installed, and the search only looks at
+its stats field at the rare nodes that end in a table or null-move cutoff.
+When they are on, the table's probe method and the timed methods of the
+backend class are wrapped. The wrappers cost time of their own, so the phase
+times add up to more than the search would take without them. Only the
+process of the AI is measured, not the helpers of a parallel search.
+"""
+
+# Backend methods timed as each phase of the search
+PHASES = (
+    ('movegen', ('generate_legal_moves', 'generate_captures')),
+    ('legality', ('check_check', 'in_check')),
+    ('eval', ('evaluate',)),
+    ('move', ('move', 'unmove')),
+)
+
+# Counters of one move, in the order they are printed and written
+COUNTERS = ('nodes', 'qnodes', 'tt_probes', 'tt_hits', 'tt_cutoffs', 'null_moves', 'null_cutoffs')
+
+
+class Stats:
+
+    def __init__(self):
+        # counted by the search and the wrappers, over the whole game
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.null_moves = 0
+        self.null_cutoffs = 0
+        self.times = dict((phase, 0.0) for phase, methods in PHASES)
+        # what each move took, and the counters when the current one started
+        self.moves = []
+        self.start = None
+        self.start_time = 0.0
+        self.wrapped = []
+        self.table = None
+        # time the last move was sent and the history length that shows it
+        self.sent = None
+        self.sent_ply = None
+
+    # This function starts counting the searches of searcher on positions of
+    # the backend class
+    def attach(self, searcher, backend):
+        searcher.stats = self
+        self.wrap_table(searcher.tt)
+        for phase, methods in PHASES:
+            for name in methods:
+                self.wrap_method(backend, name, phase)
+
+    # Puts the backend methods and the table back the way they were
+    def detach(self, searcher):
+        searcher.stats = None
+        if self.table is not None:
+            del self.table.probe
+            self.table = None
+        for cls, name, method in reversed(self.wrapped):
+            setattr(cls, name, method)
+        self.wrapped = []
+
+    # Counts the probes of the table and how many of them found the position,
+    # by shadowing its probe method on the instance
+    def wrap_table(self, tt):
+        probe = tt.probe
+
+        def counting_probe(key):
+            self.tt_probes += 1
+            data = probe(key)
+            if data:
+                self.tt_hits += 1
+            return data
+
+        tt.probe = counting_probe
+        self.table = tt
+
+    # Adds the time spent in a method of the backend class to a phase. A
+    # generator is run to the end inside the timing and returns a list.
+    def wrap_method(self, cls, name, phase):
+        method = getattr(cls, name, None)
+        if method is None:
+            return
+        times, perf_counter = self.times, time.perf_counter
+        if inspect.isgeneratorfunction(method):
+            def timed(state, *args):
+                start = perf_counter()
+                result = list(method(state, *args))
+                times[phase] += perf_counter() - start
+                return result
+        else:
+            def timed(state, *args):
+                start = perf_counter()
+                result = method(state, *args)
+                times[phase] += perf_counter() - start
+                return result
+        self.wrapped.append((cls, name, cls.__dict__.get(name, method)))
+        setattr(cls, name, timed)
+
+    # This function returns the counters and phase times so far
+    def snapshot(self):
+        values = dict((name, getattr(self, name, 0)) for name in COUNTERS)
+        values.update(self.times)
+        return values
+
+    # Called before the search of a move
+    def start_move(self):
+        self.start = self.snapshot()
+        self.start_time = time.perf_counter()
+
+    # Called after the search of a move, records what it took and returns the
+    # line to print for it
+    def end_move(self, searcher):
+        now = self.snapshot()
+        move = dict((name, now[name] - self.start[name]) for name in now)
+        move['nodes'], move['qnodes'] = searcher.nodes, searcher.qnodes
+        move['depth'] = searcher.depth
+        move['search'] = time.perf_counter() - self.start_time
+        move['cutoffs'] = list(searcher.ordering.cutoff_moves)
+        move['round_trip'] = None
+        self.moves.append(move)
+        return self.summary(move)
+
+    # Called when our move is sent to the server, with the length game.history
+    # will have once the server has played it
+    def move_sent(self, ply):
+        self.sent = time.perf_counter()
+        self.sent_ply = ply
+
+    # Called on every game update, the first one that has our move in its
+    # history ends the round trip
+    def game_updated(self, history):
+        if self.sent is not None and len(history) >= self.sent_ply and self.moves:
+            self.moves[-1]['round_trip'] = time.perf_counter() - self.sent
+            self.sent = None
+
+    # This function returns a move's stats as one line
+    def summary(self, move):
+        nodes, cutoffs = max(move['nodes'], 1), max(sum(move['cutoffs']), 1)
+        return ('Stats: {} nodes ({:.0%} quiescence) {:.0f} nps, tt {:.0%} hits {} cutoffs, '
+                'fail high {} null {}/{}, {} search {:.2f}s').format(
+            move['nodes'], move['qnodes'] / nodes, move['nodes'] / move['search'] if move['search'] else 0,
+            move['tt_hits'] / max(move['tt_probes'], 1), move['tt_cutoffs'],
+            '/'.join('{:.0%}'.format(c / cutoffs) for c in move['cutoffs'][:3]),
+            move['null_cutoffs'], move['null_moves'],
+            ' '.join('{} {:.2f}s'.format(phase, move[phase]) for phase, methods in PHASES), move['search']) + (
+            ', last round trip {:.3f}s'.format(self.moves[-2]['round_trip'])
+            if len(self.moves) > 1 and self.moves[-2]['round_trip'] is not None else '')
+
+    # This function returns the totals over every move so far
+    def totals(self):
+        totals = dict((name, sum(move[name] for move in self.moves))
+                      for name in COUNTERS + tuple(phase for phase, methods in PHASES) + ('search',))
+        totals['moves'] = len(self.moves)
+        totals['cutoffs'] = [sum(move['cutoffs'][n] for move in self.moves) for n in range(CUTOFF_SLOTS)]
+        trips = [move['round_trip'] for move in self.moves if move['round_trip'] is not None]
+        totals['round_trip'] = sum(trips)
+        totals['round_trip_max'] = max(trips) if trips else 0.0
+        return totals
+
+    # Writes the totals and every move's stats to a JSON file
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump({'totals': self.totals(), 'moves': self.moves}, f, indent=2, sort_keys=True)
@@ -0,0 +1,27 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+
+from games.chess.bench import bench, BENCH_FENS, BENCH_DEPTH, SIGNATURES
+
+"""
+Checks the bench node count signature of every backend, so a change that
+makes the search visit other nodes has to update SIGNATURES in bench.py on
+purpose. Takes a minute or two.
+
+    python -m unittest games.chess.test_bench
+"""
+
+
+class TestBench(unittest.TestCase):
+
+    def test_signatures(self):
+        for backend, expected in sorted(SIGNATURES.items()):
+            with self.subTest(backend=backend):
+                with redirect_stdout(io.StringIO()):
+                    results = bench(BENCH_FENS, BENCH_DEPTH, backend=backend)
+                self.assertEqual(results['total']['nodes'], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
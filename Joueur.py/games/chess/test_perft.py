@@ -0,0 +1,68 @@
+import random
+import unittest
+
+from games.chess.ai import BACKENDS
+from games.chess.perft import SUITE, perft, fen_color
+
+"""
+Checks the move generators of every backend: perft of the reference
+positions against their published counts, and the legal moves, captures,
+hash and evaluation of the backends against each other along random games.
+
+    python -m unittest games.chess.test_perft
+"""
+
+# Deepest perft depth checked, deep enough to reach castling, en passant and
+# promotions in the suite
+DEPTH = 3
+# Random games played from every suite position and their most plies
+PLAYOUTS = 4
+PLIES = 60
+
+
+class TestPerft(unittest.TestCase):
+
+    def test_suite(self):
+        for backend, load in sorted(BACKENDS.items()):
+            for name, fen, expected in SUITE:
+                for depth in range(1, min(DEPTH, len(expected)) + 1):
+                    with self.subTest(backend=backend, position=name, depth=depth):
+                        self.assertEqual(perft(load(fen), depth), expected[depth - 1])
+
+    def test_random_playouts(self):
+        rng = random.Random(0)
+        backends = sorted(BACKENDS.items(), key=lambda backend: backend[0] != 'mailbox')
+        for name, fen, expected in SUITE:
+            for playout in range(PLAYOUTS):
+                states = [load(fen) for backend, load in backends]
+                color = fen_color(fen)
+                for ply in range(PLIES):
+                    moves = [sorted(state.to_uci(move, color) for move in state.generate_legal_moves())
+                             for state in states]
+                    captures = [sorted(state.to_uci(move, color) for move in state.generate_captures())
+                                for state in states]
+                    where = '{} game {} ply {}'.format(name, playout, ply)
+                    for (backend, load), state, legal, capture in zip(backends[1:], states[1:], moves[1:],
+                                                                      captures[1:]):
+                        with self.subTest(backend=backend, at=where):
+                            self.assertEqual(legal, moves[0])
+                            self.assertEqual(capture, captures[0])
+                            self.assertEqual(state.hash, states[0].hash)
+                            self.assertEqual(state.evaluate(), states[0].evaluate())
+                    if not moves[0]:
+                        break
+                    uci = rng.choice(moves[0])
+                    states = [play(state, uci, color) for state in states]
+                    color = 'black' if color == 'white' else 'white'
+
+
+# This function returns the position after the move with the given UCI string
+def play(state, uci, color):
+    for move in state.generate_legal_moves():
+        if state.to_uci(move, color) == uci:
+            return state.move(move)
+    raise ValueError(uci)
+
+
+if __name__ == '__main__':
+    unittest.main()
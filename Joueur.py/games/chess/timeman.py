@@ -0,0 +1,105 @@
+import time
+
+"""
+Time management: how long to think about one move. Every move gets a soft
+budget, the time it should normally take, and a hard budget, the deadline
+the search is interrupted at no matter what. The soft budget is the clock
+divided by the moves still expected in the game plus most of the increment.
+Between iterations the search asks whether to start another one: the soft
+budget is stretched while the best move keeps changing or the score drops,
+and cut short when one move has stayed the best with a steady score for
+several iterations, because searching deeper is unlikely to change it.
+
+The server doesn't tell us the increment, so unless it is given it is worked
+out from how much the clock grew between the end of one move and the start
+of the next.
+"""
+
+# Moves the rest of the game is expected to take at the start, and at least
+MOVES_TO_GO = 40
+MIN_MOVES_TO_GO = 20
+# Fraction of the increment spent on top of the share of the clock
+INCREMENT_USE = 0.8
+# The hard budget is this many soft budgets, and never more than this part of
+# what is left on the clock plus the increment, or than half of the clock
+HARD_FACTOR = 4
+MAX_CLOCK_FRACTION = 0.25
+# Kept back from every budget for the round trip to the server, in seconds
+OVERHEAD = 0.05
+MIN_BUDGET = 0.01
+
+# An iteration usually takes longer than all the ones before it together, so
+# no new one is started after this part of the stretched soft budget
+NEXT_ITERATION = 0.5
+# The soft budget is stretched by this when the best move changes, and by this
+# when the score drops by at least SCORE_DROP, up to MAX_STRETCH times
+BEST_MOVE_CHANGE = 1.4
+SCORE_DROP = 30
+SCORE_DROP_STRETCH = 1.3
+MAX_STRETCH = 3.0
+# A move that stayed the best for DOMINANT_ITERATIONS iterations in a row
+# without its score dropping is played after DOMINANT_TIME of the soft budget
+DOMINANT_ITERATIONS = 4
+DOMINANT_TIME = 0.3
+
+
+class TimeManager:
+
+    def __init__(self, increment=None):
+        # a given increment is used as is, else it is measured
+        self.fixed_increment = increment
+        self.increment = increment or 0.0
+        self.clock_after_move = None
+        self.soft = self.hard = 0.0
+        self.start_time = 0.0
+
+    # This function sets the budgets of the move about to be searched, given
+    # the seconds left on our clock and the number of moves we played so far
+    def start(self, time_remaining, moves_played=0):
+        self.start_time = time.perf_counter()
+        if self.fixed_increment is None and self.clock_after_move is not None:
+            self.increment = max(0.0, time_remaining - self.clock_after_move)
+        self.time_remaining = time_remaining
+        moves_to_go = max(MIN_MOVES_TO_GO, MOVES_TO_GO - moves_played // 2)
+        self.soft = time_remaining / moves_to_go + INCREMENT_USE * self.increment
+        self.hard = min(HARD_FACTOR * self.soft, MAX_CLOCK_FRACTION * time_remaining + self.increment,
+                        time_remaining / 2)
+        self.soft = max(MIN_BUDGET, min(self.soft, self.hard) - OVERHEAD)
+        self.hard = max(MIN_BUDGET, self.hard - OVERHEAD)
+        self.stretch = 1.0
+        self.best_move = None
+        self.score = None
+        self.dominant = 0
+
+    # Called once the move is sent, so the next start() can see the increment
+    def stop(self):
+        self.clock_after_move = self.time_remaining - self.elapsed()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    # This function checks if a search of this move's position that took the
+    # given seconds to finish its last iteration, the ponder search, is
+    # already as deep as this move's budget would get by the rule of
+    # next_iteration
+    def enough(self, seconds):
+        return seconds >= NEXT_ITERATION * self.soft
+
+    # This function is called after every completed iteration with its best
+    # move and score, and returns whether another iteration should be started
+    def next_iteration(self, best_move, score):
+        dropped = self.score is not None and score <= self.score - SCORE_DROP
+        if self.best_move is not None and best_move != self.best_move:
+            self.stretch = min(MAX_STRETCH, self.stretch * BEST_MOVE_CHANGE)
+        if dropped:
+            self.stretch = min(MAX_STRETCH, self.stretch * SCORE_DROP_STRETCH)
+        if best_move == self.best_move and not dropped:
+            self.dominant += 1
+        else:
+            self.dominant = 0
+        self.best_move, self.score = best_move, score
+
+        elapsed = self.elapsed()
+        if self.dominant >= DOMINANT_ITERATIONS and elapsed >= DOMINANT_TIME * self.soft:
+            return False
+        return elapsed < NEXT_ITERATION * self.soft * self.stretch
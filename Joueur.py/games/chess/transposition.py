@@ -0,0 +1,179 @@
+from array import array
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # before Python 3.8
+    shared_memory = None
+
+"""
+A fixed size transposition table keyed by the Zobrist hash of a State.
+Entries live in two flat arrays of unsigned 64-bit integers, one for the keys
+and one for the packed entry data, so the table costs exactly the memory it
+was given and a lookup never builds a tuple or a dict entry.
+
+The table is split into buckets of two slots. The first slot keeps the entry
+that was searched the deepest, the second one is always replaced.
+
+A slot's key is stored XORed with its data word. Key and data are written one
+after the other, so a reader in another process can see the key of one entry
+with the data of another. With the XOR the two no longer give back the key
+and the slot is treated as empty, so the shared table needs no locks.
+"""
+
+
+# Bytes used by one entry, 8 for the key and 8 for the data
+ENTRY_SIZE = 16
+SLOTS = 2
+
+# Bound types of a stored score
+LOWER, UPPER, EXACT = 1, 2, 3
+
+# Layout of the packed data word:
+#   bits  0-6   from square of the best move
+#   bits  7-13  to square of the best move
+#   bits 14-15  underpromotion of the best move, an index into PROMOTIONS
+#   bits 16-45  score + SCORE_OFFSET
+#   bits 46-53  depth
+#   bits 54-55  bound type (0 means an empty slot)
+#   bits 56-63  search generation the entry was written in
+SCORE_OFFSET = 1 << 29
+MOVE_SHIFT, PROMOTION_SHIFT, SCORE_SHIFT, DEPTH_SHIFT, FLAG_SHIFT, AGE_SHIFT = 7, 14, 16, 46, 54, 56
+MASK7, MASK8, MASK30 = 0x7F, 0xFF, 0x3FFFFFFF
+
+# A move is (from, to), or (from, to, piece) for a promotion to anything but a
+# queen. 0 stands for a plain move or a queen promotion.
+PROMOTIONS = (None, 'N', 'B', 'R')
+
+
+# Packs a move, score, depth and bound type into one data word
+def pack(move, score, depth, flag, age):
+    i, j = (move[0], move[1]) if move else (0, 0)
+    promotion = PROMOTIONS.index(move[2]) if move and len(move) > 2 else 0
+    return (i | j << MOVE_SHIFT | promotion << PROMOTION_SHIFT | (score + SCORE_OFFSET) << SCORE_SHIFT
+            | max(depth, 0) << DEPTH_SHIFT | flag << FLAG_SHIFT | age << AGE_SHIFT)
+
+
+# These functions unpack the fields of a data word returned by probe()
+def entry_move(data):
+    i, j = data & MASK7, data >> MOVE_SHIFT & MASK7
+    if not i and not j:
+        return None
+    promotion = data >> PROMOTION_SHIFT & 3
+    return (i, j, PROMOTIONS[promotion]) if promotion else (i, j)
+
+
+def entry_score(data):
+    return (data >> SCORE_SHIFT & MASK30) - SCORE_OFFSET
+
+
+def entry_depth(data):
+    return data >> DEPTH_SHIFT & MASK8
+
+
+def entry_flag(data):
+    return data >> FLAG_SHIFT & 3
+
+
+class TranspositionTable:
+
+    def __init__(self, size_mb=16):
+        # Round down to a power of two number of buckets so a mask picks the bucket
+        buckets = max(1, size_mb * (1 << 20) // (ENTRY_SIZE * SLOTS))
+        buckets = 1 << (buckets.bit_length() - 1)
+        self.mask = buckets - 1
+        self.size = buckets * SLOTS
+        self.size_mb = size_mb
+        self.keys, self.data = self.allocate()
+        self.age = 0
+
+    # This function returns the key and data arrays, all zero
+    def allocate(self):
+        return array('Q', [0]) * self.size, array('Q', [0]) * self.size
+
+    # Number of bytes held by the table
+    def memory(self):
+        return (len(self.keys) + len(self.data)) * 8
+
+    # Called once per search so entries from older searches get replaced first
+    def new_search(self):
+        self.age = (self.age + 1) & MASK8
+
+    # Drops every entry
+    def clear(self):
+        self.keys, self.data = self.allocate()
+
+    # This function returns the packed data stored for the key, or 0 if the
+    # position isn't in the table
+    def probe(self, key):
+        i = (key & self.mask) * SLOTS
+        keys, data = self.keys, self.data
+        d = data[i]
+        if keys[i] ^ d == key:
+            return d
+        d = data[i + 1]
+        if keys[i + 1] ^ d == key:
+            return d
+        return 0
+
+    # This function stores an entry, preferring the first slot of the bucket when
+    # the new entry was searched at least as deep as the one already in it
+    def store(self, key, move, score, depth, flag):
+        i = (key & self.mask) * SLOTS
+        keys, data = self.keys, self.data
+        old = data[i]
+        if (keys[i] ^ old == key or depth >= (old >> DEPTH_SHIFT & MASK8)
+                or (old >> AGE_SHIFT) != self.age):
+            # Keep the old best move if this search didn't find one
+            if move is None and keys[i] ^ old == key:
+                move = entry_move(old)
+        else:
+            i += 1
+            if move is None and keys[i] ^ data[i] == key:
+                move = entry_move(data[i])
+        d = pack(move, score, depth, flag, self.age)
+        keys[i] = key ^ d
+        data[i] = d
+
+
+# This function attaches to the shared table of the given name
+def attach_shared(name, size_mb):
+    return SharedTranspositionTable(size_mb, name)
+
+
+# The same table in a multiprocessing.shared_memory block, so the processes of
+# a parallel search all probe and fill one table. It pickles to the name of
+# its block and is attached again on the other side.
+class SharedTranspositionTable(TranspositionTable):
+
+    def __init__(self, size_mb=16, name=None):
+        if shared_memory is None:
+            raise RuntimeError('a shared transposition table needs Python 3.8 or newer')
+        self.name = name
+        TranspositionTable.__init__(self, size_mb)
+
+    # Creates the block, or attaches to the existing one of the given name,
+    # and lays the key and data arrays over it
+    def allocate(self):
+        size = self.size * ENTRY_SIZE
+        if self.name is None:
+            self.owner = True
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shm.buf[:size] = bytes(size)
+        else:
+            self.owner = False
+            self.shm = shared_memory.SharedMemory(name=self.name)
+        self.name = self.shm.name
+        return self.shm.buf[:self.size * 8].cast('Q'), self.shm.buf[self.size * 8:size].cast('Q')
+
+    def __reduce__(self):
+        return attach_shared, (self.shm.name, self.size_mb)
+
+    def clear(self):
+        self.shm.buf[:self.size * ENTRY_SIZE] = bytes(self.size * ENTRY_SIZE)
+
+    # Lets go of the block, and frees it in the process that created it
+    def close(self):
+        self.keys.release()
+        self.data.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()